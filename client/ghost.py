@@ -2,6 +2,7 @@
 # -*- coding:utf-8 -*-
 import PyQt5
 import click
+import asyncio
 import qtinter
 import qdarktheme
 
@@ -12,6 +13,7 @@ from lib.ui import tab_widget
 
 # Tabs
 from lib.ui.tabs import teamserver_event_log_tab
+from lib.ui.tabs import teamserver_metrics_tab
 
 # Dialogs
 from lib.ui.dialogs import export_payload_dialog
@@ -79,6 +81,16 @@ class Ghost( PyQt5.QtWidgets.QMainWindow ):
         self.teamserver_menu_action_view_event_log.triggered.connect( self._menu_action_teamserver_view_event_log );
         self.teamserver_menu.addAction( self.teamserver_menu_action_view_event_log );
 
+        # Menu: "Teamserver". Action: "View Metrics"
+        self.teamserver_menu_action_view_metrics = PyQt5.QtWidgets.QAction( 'View Metrics' );
+        self.teamserver_menu_action_view_metrics.triggered.connect( self._menu_action_teamserver_view_metrics );
+        self.teamserver_menu.addAction( self.teamserver_menu_action_view_metrics );
+
+        # Menu: "Teamserver". Action: "Profile Teamserver"
+        self.teamserver_menu_action_profile = PyQt5.QtWidgets.QAction( 'Profile Teamserver (30s)' );
+        self.teamserver_menu_action_profile.triggered.connect( self._menu_action_teamserver_profile );
+        self.teamserver_menu.addAction( self.teamserver_menu_action_profile );
+
         # Menu: "Operator". A collection of options for creating agents or viewing
         # collected data
         self.operator_menu = self.menuBar().addMenu( 'Operator' );
@@ -114,6 +126,9 @@ class Ghost( PyQt5.QtWidgets.QMainWindow ):
         # Print that we got a connection!
         self.log.info( f'Successfully established a connection to {self.teamserver_host}:{self.teamserver_port}' );
 
+        # load the current agents, changes are pushed to us from here on
+        await self.agents_widget.agents_load();
+
         # open a teamserver tab to view the log as the first tab
         await self._menu_action_teamserver_view_event_log();
 
@@ -128,6 +143,41 @@ class Ghost( PyQt5.QtWidgets.QMainWindow ):
         # Open the tab and display it to the user. Ensure only one is honestly open at a time.
         await self.tab_widget.tab_add( teamserver_event_log_tab.TeamserverEventLogTab( self ), f'Event Log', False );
 
+    @qtinter.asyncslot
+    async def _menu_action_teamserver_view_metrics( self ):
+        """
+        Opens a tab to view the teamserver metrics
+        """
+        # Open the tab and display it to the user. Only one is open at a time.
+        await self.tab_widget.tab_add( teamserver_metrics_tab.TeamserverMetricsTab( self ), f'Metrics', False );
+
+    @qtinter.asyncslot
+    async def _menu_action_teamserver_profile( self ):
+        """
+        Profiles the teamserver for 30 seconds and saves the collapsed stacks.
+        """
+        # Open a dialog to request where to save the profile
+        path_to_file, _ = PyQt5.QtWidgets.QFileDialog.getSaveFileName( self, "Save Profile", "", "Collapsed Stacks (*.folded)", options = PyQt5.QtWidgets.QFileDialog.Options() | PyQt5.QtWidgets.QFileDialog.DontUseNativeDialog );
+
+        # No path chosen? Nothing to do
+        if not path_to_file:
+            return
+
+        # Somebody else is already profiling?
+        if not await self.rpc.teamserver_profile_start( 30 ):
+            self.log.error( f'The teamserver is already being profiled' );
+            return
+
+        # Let it sample, then collect the profile
+        await asyncio.sleep( 30 );
+        profile = await self.rpc.teamserver_profile_stop();
+
+        # Save it!
+        with open( path_to_file, 'w' ) as file:
+            file.write( profile );
+
+        self.log.info( f'Saved the teamserver profile to {path_to_file}' );
+
     @qtinter.asyncslot
     async def _menu_action_operator_export_payload( self ):
         """
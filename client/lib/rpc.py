@@ -4,6 +4,7 @@ import PyQt5
 import base64
 import qtinter
 import asyncio
+import websockets
 
 from fastapi_websocket_rpc import WebSocketRpcClient
 from fastapi_websocket_rpc import RpcMethodsBase
@@ -19,6 +20,29 @@ class RpcClientMethods( RpcMethodsBase ):
         # set the ghost object
         self.ghost = ghost
 
+    async def teamserver_event_log_push( self, events : list = [] ):
+        """
+        Called by the teamserver with new events as soon as they are logged.
+        """
+        # Hand the events to any open event log tabs
+        await self.ghost.tab_widget.tab_notify( 'event_log_push', events );
+
+    async def teamserver_agent_list_push( self, versions : list = [] ):
+        """
+        Called by the teamserver with the new agent table version whenever
+        agents are added, changed or removed.
+        """
+        # Update the agents table
+        await self.ghost.agents_widget.agents_update( max( versions ) );
+
+    async def teamserver_agent_log_push( self, cursors : list = [] ):
+        """
+        Called by the teamserver with [ agent_id, last_id ] pairs whenever
+        output is appended to agent console logs.
+        """
+        # Hand the cursors to any open agent console tabs
+        await self.ghost.tab_widget.tab_notify( 'agent_log_push', cursors );
+
 class RpcClient:
     """
     A RPC client for calling arbitrary methods on the server like exporting a 
@@ -73,15 +97,93 @@ class RpcClient:
             is_arch64 = is_arch64
         ) ).result );
 
+    async def teamserver_export_payload_stream( self, ip_address, icmp_sleep, icmp_sleep_jitter, icmp_chunk_length, icmp_query_timeout, sleep, jitter, kill_date, is_arch64 ) -> str:
+        """
+        Requests that the server prepare a configured shellcode on the binary channel and
+        return the token to collect it with.
+        """
+        # Execute the remote method and return the token
+        return ( await self.rpc.other.teamserver_export_payload_stream(
+            ip_address = ip_address,
+            icmp_sleep = icmp_sleep,
+            icmp_sleep_jitter = icmp_sleep_jitter,
+            icmp_chunk_length = icmp_chunk_length,
+            icmp_query_timeout = icmp_query_timeout,
+            sleep = sleep,
+            jitter = jitter,
+            kill_date = kill_date,
+            is_arch64 = is_arch64
+        ) ).result
+
+    async def teamserver_blob_get( self, token, file ) -> bool:
+        """
+        Collects the blob for the token from the binary channel and writes it to the file
+        as it arrives. Returns whether the whole blob was received.
+        """
+        try:
+            # Connect to the binary channel for this token
+            async with websockets.connect( f'ws://{self.ghost.teamserver_host}:{self.ghost.teamserver_port}/blob/{token}' ) as websock:
+                # Write each chunk as we recieve it
+                async for chunk in websock:
+                    file.write( chunk );
+        except ( websockets.exceptions.InvalidHandshake, websockets.exceptions.ConnectionClosedError ):
+            # The token was refused or the transfer was cut short
+            return False
+
+        # Recieved all of it
+        return True
+
+    async def teamserver_export_payload_bulk( self, payloads ) -> list:
+        """
+        Requests that the server return a configured shellcode for each dictionary of
+        options in the list.
+        """
+        # Execute the remote method and decode each response from base64
+        return [ base64.b64decode( payload ) for payload in ( await self.rpc.other.teamserver_export_payload_bulk( payloads = payloads ) ).result ];
+
     async def teamserver_agent_list_get( self ) -> list:
         """
         Requests that the teamserver return a list of all the agents in the database
         """
         return ( ( await self.rpc.other.teamserver_agent_list_get() ).result );
 
-    async def teamserver_event_log_get( self, log_offset ) -> list:
+    async def teamserver_agent_list_diff( self, since_version ) -> dict:
+        """
+        Requests that the teamserver return the agents added, changed or removed since the
+        specified agent table version
+        """
+        return ( ( await self.rpc.other.teamserver_agent_list_diff( since_version = since_version ) ).result );
+
+    async def teamserver_event_log_get( self, log_offset, last_id = None ) -> list:
+        """
+        Requests that the teamserver return a list of all the events past the last log offset,
+        or past the last event id if one is given
+        """
+        # Request the event log starting @ log_offset / last_id
+        return ( ( await self.rpc.other.teamserver_event_log_get( log_offset = log_offset, last_id = last_id ) ).result );
+
+    async def teamserver_agent_log_get( self, agent_id, after_id, limit = 256 ) -> list:
+        """
+        Requests that the teamserver return up to limit entries of the agent's console log
+        past the last entry id
+        """
+        # Request the agent log starting after after_id
+        return ( ( await self.rpc.other.teamserver_agent_log_get( agent_id = agent_id, after_id = after_id, limit = limit ) ).result );
+
+    async def teamserver_metrics_get( self ) -> dict:
+        """
+        Requests that the teamserver return its counters and per stage latencies
+        """
+        return ( ( await self.rpc.other.teamserver_metrics_get() ).result );
+
+    async def teamserver_profile_start( self, duration, interval = 0.005 ) -> bool:
+        """
+        Requests that the teamserver start sampling its event loop for at most duration seconds
+        """
+        return ( ( await self.rpc.other.teamserver_profile_start( duration = duration, interval = interval ) ).result );
+
+    async def teamserver_profile_stop( self ) -> str:
         """
-        Requests that the teamserver return a list of all the events past the last log offset
+        Requests that the teamserver stop sampling and return the profile as collapsed stacks
         """
-        # Request the event log starting @ log_offset
-        return ( ( await self.rpc.other.teamserver_event_log_get( log_offset = log_offset ) ).result );
+        return ( ( await self.rpc.other.teamserver_profile_stop() ).result );
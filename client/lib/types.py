@@ -6,3 +6,7 @@ class EventLogType( enum.IntEnum ):
     INFO    = 0
     GOOD    = 1
     ERROR   = 2
+
+class AgentLogType( enum.IntEnum ):
+    OUTPUT  = 0
+    ERROR   = 1
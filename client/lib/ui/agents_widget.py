@@ -4,6 +4,8 @@ import PyQt5
 import asyncio
 import qtinter
 
+from lib.ui.tabs import agent_console_tab
+
 class AgentsWidget( PyQt5.QtWidgets.QWidget ):
     """
     A 'core' display within the ghost application view. Intended
@@ -30,8 +32,13 @@ class AgentsWidget( PyQt5.QtWidgets.QWidget ):
         # create the primary layout for this widget
         self.layout = PyQt5.QtWidgets.QHBoxLayout();
 
-        # List of agents in the database
-        self.agents = []
+        # Table of agents in the database and the row they are displayed in
+        self.agents = {}
+
+        # Version of the teamserver agent table the rows reflect, and the
+        # latest version the teamserver told us about
+        self.agent_version = 0
+        self.agent_version_latest = 0
 
         # create the table to display the agents
         self.agent_table = PyQt5.QtWidgets.QTableWidget();
@@ -43,6 +50,8 @@ class AgentsWidget( PyQt5.QtWidgets.QWidget ):
         self.agent_table.setHorizontalHeaderLabels( self.COLUMN_NAMES );
         self.agent_table.verticalHeader().setVisible( False );
         self.agent_table.horizontalHeader().setHighlightSections( False );
+        self.agent_table.setEditTriggers( PyQt5.QtWidgets.QAbstractItemView.NoEditTriggers );
+        self.agent_table.cellDoubleClicked.connect( self._agent_console_open );
 
         # Loop through each column
         for i in range( 0, self.COLUMN_COUNT ):
@@ -52,29 +61,119 @@ class AgentsWidget( PyQt5.QtWidgets.QWidget ):
         # add the table to the primary layout
         self.layout.addWidget( self.agent_table );
 
-        # Lock for monitoring agents callback
-        self.monitor_agent_lock = asyncio.Lock();
-
-        # create the async queue for monitoring agents
-        self.monitor_agent = PyQt5.QtCore.QTimer();
-        self.monitor_agent.setInterval( 100 );
-        self.monitor_agent.timeout.connect( self._monitor_agents );
-        self.monitor_agent.start()
+        # Task reading the agent changes, one at a time
+        self.monitor_agent_task = None
 
         # set the layout for this layout
         self.setLayout( self.layout );
 
-    async def _monitor_agents_add( self ):
+    async def agents_load( self ):
+        """
+        Reads the full list of agents once the teamserver is connected. Any
+        changes after this are pushed to agents_update.
+        """
+        await self._agents_read_start();
+
+    async def agents_update( self, version ):
+        """
+        Notes that the teamserver agent table has reached version and starts
+        reading the changes unless a read is already running. Called from the
+        RPC reader, so it must never wait on an RPC itself.
+        """
+        # Remember the newest version we have been told about
+        self.agent_version_latest = max( self.agent_version_latest, version );
+
+        # Already up to date?
+        if version <= self.agent_version:
+            return
+
+        self._agents_read_start();
+
+    def _agents_read_start( self ):
+        """
+        Starts the task reading the agent changes if it is not running, and
+        returns it.
+        """
+        if self.monitor_agent_task is None or self.monitor_agent_task.done():
+            self.monitor_agent_task = asyncio.create_task( self._agents_read() );
+
+        return self.monitor_agent_task
+
+    async def _agents_read( self ):
         """
-        Adds an agent to the table.
+        Requests the agent changes since the version the table reflects and
+        applies them, until the table reaches the latest version pushed to us.
         """
-        pass
+        while True:
+            # Query the changes to the list of agents!
+            agent_diff = await self.ghost.rpc.teamserver_agent_list_diff( self.agent_version );
+
+            # Loop through the changed agents
+            for agent in agent_diff[ 'updated' ]:
+                # Add or update them in the table
+                await self._monitor_agents_add( agent );
+
+            # Loop through the removed agents
+            for agent_id in agent_diff[ 'removed' ]:
+                # Remove them from the table
+                await self._monitor_agents_del( agent_id );
+
+            # Set the version we are now at
+            self.agent_version = agent_diff[ 'version' ];
+
+            # Did more changes get pushed while we were reading?
+            if self.agent_version >= self.agent_version_latest:
+                return
 
     @qtinter.asyncslot
-    async def _monitor_agents( self ):
+    async def _agent_console_open( self, agent_row, agent_column ):
+        """
+        Opens the console tab of the agent that was double clicked, or switches
+        to it if it is already open.
+        """
+        # Which agent is displayed in that row?
+        for agent_id, other_row in self.agents.items():
+            if other_row == agent_row:
+                # Open its console
+                await self.ghost.tab_widget.tab_add( agent_console_tab.AgentConsoleTab( self.ghost, agent_id ), f'{agent_id:08x}', False );
+                return
+
+    async def _monitor_agents_add( self, agent ):
         """
-        Monitors for new agents and updates the table with their information.
+        Adds an agent to the table, or updates its row if it is already there.
         """
-        async with self.monitor_agent_lock:
-            # Query the list of the agents!
-            agent_list = await self.ghost.rpc.teamserver_agent_list_get();
+        # Is this a new agent?
+        if agent[ 'id' ] not in self.agents:
+            # Add a row to the end of the table for it
+            self.agents[ agent[ 'id' ] ] = self.agent_table.rowCount();
+            self.agent_table.insertRow( self.agent_table.rowCount() );
+
+        # Row the agent is displayed in
+        agent_row = self.agents[ agent[ 'id' ] ]
+
+        # Fill in each column
+        for column, value in enumerate( [ f'{agent[ "id" ]:08x}',
+                                          f'{agent[ "os_major" ]}.{agent[ "os_minor" ]}.{agent[ "os_build" ]}',
+                                          agent[ 'process' ],
+                                          str( agent[ 'pid' ] ),
+                                          str( agent[ 'ppid' ] ),
+                                          agent.get( 'username', '' ) ] ):
+            # Set the cell text
+            self.agent_table.setItem( agent_row, column, PyQt5.QtWidgets.QTableWidgetItem( value ) );
+
+    async def _monitor_agents_del( self, agent_id ):
+        """
+        Removes an agent from the table if it is displayed.
+        """
+        # Not displayed?
+        if agent_id not in self.agents:
+            return
+
+        # Remove the row
+        agent_row = self.agents.pop( agent_id );
+        self.agent_table.removeRow( agent_row );
+
+        # Shift up the agents displayed below it
+        for other_id, other_row in self.agents.items():
+            if other_row > agent_row:
+                self.agents[ other_id ] = other_row - 1
@@ -169,20 +169,24 @@ class ExportPayloadDialog( PyQt5.QtWidgets.QDialog ):
         # Close the dialog
         self.close()
 
-        # generate a payload with the requested options
-        shellcode = await self.ghost.rpc.teamserver_export_payload( self.ipv4_address.text(), self.icmp_chunk_sleep.value(), self.icmp_chunk_jitter.value(), self.icmp_chunk_length.value(), self.icmp_chunk_timeout.value(),
-                                                                    self.sleep.value(), self.jitter.value(), calendar.timegm( self.kill_date.dateTime().toPyDateTime().timetuple() ), self.ext_opt_x64.isChecked() );
+        # Open a dialog to request a specific path we want to target
+        path_to_file, _ = PyQt5.QtWidgets.QFileDialog.getSaveFileName( self.ghost, "Save Payload", "", "Binary Files (*.bin)", options = PyQt5.QtWidgets.QFileDialog.Options() | PyQt5.QtWidgets.QFileDialog.DontUseNativeDialog );
+
+        # No path chosen? Nothing to do
+        if not path_to_file:
+            return
 
-        # Did we get a shellcode response? This means that we can now save it!
-        if shellcode:
-            # Open a dialog to request a specific path we want to target
-            path_to_file, _ = PyQt5.QtWidgets.QFileDialog.getSaveFileName( self.ghost, "Save Payload", "", "Binary Files (*.bin)", options = PyQt5.QtWidgets.QFileDialog.Options() | PyQt5.QtWidgets.QFileDialog.DontUseNativeDialog );
+        # generate a payload with the requested options
+        token = await self.ghost.rpc.teamserver_export_payload_stream( self.ipv4_address.text(), self.icmp_chunk_sleep.value(), self.icmp_chunk_jitter.value(), self.icmp_chunk_length.value(), self.icmp_chunk_timeout.value(),
+                                                                       self.sleep.value(), self.jitter.value(), calendar.timegm( self.kill_date.dateTime().toPyDateTime().timetuple() ), self.ext_opt_x64.isChecked() );
 
+        # Did we get a token? This means that we can now stream it to the path!
+        if token:
             # Open the target path!
-            if path_to_file: 
-                with open( path_to_file, 'wb+' ) as file:
-                    # Write the shellcode to the path!
-                    file.write( shellcode );
-        else:
-            # Open an error box notifying the client to check the agent
-            qtinter.modal( PyQt5.QtWidgets.QMessageBox.critical( self.ghost, 'Export Payload Error', 'Failed to export a payload. See teamserver console for more details.' ) );
+            with open( path_to_file, 'wb+' ) as file:
+                # Write the shellcode to the path as it arrives!
+                if await self.ghost.rpc.teamserver_blob_get( token, file ):
+                    return
+
+        # Open an error box notifying the client to check the agent
+        qtinter.modal( PyQt5.QtWidgets.QMessageBox.critical( self.ghost, 'Export Payload Error', 'Failed to export a payload. See teamserver console for more details.' ) );
@@ -130,3 +130,20 @@ class TabWidget( PyQt5.QtWidgets.QWidget ):
 
         # Nothing is returned.
         return None
+
+    async def tab_notify( self, method, *args ):
+        """
+        Calls the named coroutine on every open tab that implements it.
+        Intended to be used by the RPC callbacks.
+        """
+        # Lock access to the list to prevent a race condition
+        async with self.tabs_list_lock:
+            # Take a snapshot of the open tabs
+            tabs_objects = [ tab_entry[ 'object' ] for tab_entry in self.tabs_list ]
+
+        # Loop through the tabs
+        for tab_object in tabs_objects:
+            # Does the tab handle this notification?
+            if hasattr( tab_object, method ):
+                # Pass it on!
+                await getattr( tab_object, method )( *args );
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import PyQt5
+import asyncio
+import qtinter
+
+from lib import types
+
+# Entries requested per call when catching up on the console log
+AGENT_LOG_PAGE = 256
+
+# Lines kept in the console before the oldest are discarded
+AGENT_LOG_MAX_LINES = 100000
+
+class AgentConsoleTab( PyQt5.QtWidgets.QWidget ):
+    """
+    A 'tab' for tailing an agent's console output.
+    """
+    def __init__( self, ghost, agent_id ):
+        # Initialize the parent
+        super( PyQt5.QtWidgets.QWidget, self ).__init__( ghost );
+
+        # Set the ghost object
+        self.ghost = ghost
+
+        # Set the agent whose output we display
+        self.agent_id = agent_id
+
+        # Set the id of the last entry read from the agent's log, and the
+        # latest id the teamserver told us about
+        self.log_last_id = 0
+        self.log_latest_id = 0
+
+        # Set the output layout
+        self.layout = PyQt5.QtWidgets.QHBoxLayout();
+
+        # Widget for handling agent output. Plain text with a line cap so
+        # tailing large output stays cheap
+        self.output = PyQt5.QtWidgets.QPlainTextEdit();
+        self.output.setReadOnly( True );
+        self.output.setMaximumBlockCount( AGENT_LOG_MAX_LINES );
+        self.output.setFocusPolicy( PyQt5.QtCore.Qt.NoFocus );
+
+        # Add the widget to the layout
+        self.layout.addWidget( self.output );
+
+        # Task reading the log, one at a time
+        self.monitor_log_task = None
+
+        # Timer for reading the log backlog once, new output is pushed to us
+        self.monitor_log = PyQt5.QtCore.QTimer();
+        self.monitor_log.setSingleShot( True );
+        self.monitor_log.setInterval( 0 );
+        self.monitor_log.timeout.connect( self._monitor_log );
+        self.monitor_log.start()
+
+        # Set the layout
+        self.setLayout( self.layout );
+
+    async def write_to_log( self, message ):
+        """
+        Writes the message to the console and adjusts the scroll bar.
+        """
+        # Append the message to the console
+        self.output.appendPlainText( message );
+
+        # Adjust the console position to the end
+        self.output.moveCursor( PyQt5.QtGui.QTextCursor.End );
+
+    async def agent_log_push( self, log_cursors ):
+        """
+        Starts reading any new output when the teamserver reports the agent's
+        log has moved past the last entry we read. Called from the RPC reader,
+        so it must never wait on an RPC itself.
+        """
+        # How far has our agent's log gone?
+        self.log_latest_id = max( [ self.log_latest_id ] + [ cursor[ 1 ] for cursor in log_cursors if cursor[ 0 ] == self.agent_id ] );
+
+        # Nothing new for us
+        if self.log_latest_id <= self.log_last_id:
+            return
+
+        # Catch up
+        self._read_log_start();
+
+    @qtinter.asyncslot
+    async def _monitor_log( self ):
+        """
+        Reads the agent's log backlog. Anything logged after this is reported
+        to agent_log_push.
+        """
+        await self._read_log_start();
+
+    def _read_log_start( self ):
+        """
+        Starts the task reading the log if it is not running, and returns it.
+        """
+        if self.monitor_log_task is None or self.monitor_log_task.done():
+            self.monitor_log_task = asyncio.create_task( self._read_log() );
+
+        return self.monitor_log_task
+
+    async def _read_log( self ):
+        """
+        Reads the agent's log after the last entry we read and writes it to
+        the console until caught up with the latest id pushed to us.
+        """
+        while True:
+            # Attempt to pull the next page after the last entry we read
+            log_results = await self.ghost.rpc.teamserver_agent_log_get( self.agent_id, self.log_last_id, AGENT_LOG_PAGE );
+
+            # Write them out
+            await self._write_entries( log_results );
+
+            # A short page means we are caught up, unless more was pushed meanwhile
+            if not log_results or ( len( log_results ) < AGENT_LOG_PAGE and self.log_last_id >= self.log_latest_id ):
+                return
+
+    async def _write_entries( self, log_results ):
+        """
+        Writes the entries to the console and moves the last entry id forward.
+        """
+        # No results were returned. Abort
+        if not log_results:
+            return
+
+        # Set the last entry id
+        self.log_last_id = log_results[ -1 ][ 'id' ];
+
+        # Loop through the list of log results
+        for log_entry in log_results:
+            if log_entry[ 'type' ] == types.AgentLogType.ERROR:
+                # Flag errors
+                await self.write_to_log( f'[-] {log_entry[ "message" ]}' );
+            else:
+                # Write the output as is
+                await self.write_to_log( log_entry[ 'message' ] );
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 import PyQt5
-import asyncio
 import qtinter
 
 from lib import types
@@ -17,8 +16,8 @@ class TeamserverEventLogTab( PyQt5.QtWidgets.QWidget ):
         # Set the ghost object
         self.ghost = ghost
 
-        # Set the last recorded offset into the log
-        self.log_offset = 0
+        # Set the id of the last event read from the log
+        self.log_last_id = 0
 
         # Set the output layout
         self.layout = PyQt5.QtWidgets.QHBoxLayout();
@@ -31,12 +30,14 @@ class TeamserverEventLogTab( PyQt5.QtWidgets.QWidget ):
         # Add the widget to the layout
         self.layout.addWidget( self.output );
 
-        # Lock for monitoring logs
-        self.monitor_log_lock = asyncio.Lock();
+        # Events pushed to us while the backlog is being read, written once
+        # it has been. None when not reading the backlog
+        self.monitor_log_pushed = []
 
-        # Timer for polling for new log data
+        # Timer for reading the log backlog once, new events are pushed to us
         self.monitor_log = PyQt5.QtCore.QTimer();
-        self.monitor_log.setInterval( 100 );
+        self.monitor_log.setSingleShot( True );
+        self.monitor_log.setInterval( 0 );
         self.monitor_log.timeout.connect( self._monitor_log );
         self.monitor_log.start()
 
@@ -57,44 +58,74 @@ class TeamserverEventLogTab( PyQt5.QtWidgets.QWidget ):
         # Set the new cursor position
         self.output.setTextCursor( cursor );
 
+    async def event_log_push( self, log_results ):
+        """
+        Writes events pushed by the teamserver to the log. Called from the
+        RPC reader, so it must never wait on an RPC itself.
+        """
+        # Still reading the backlog? Hold them until it is done
+        if self.monitor_log_pushed is not None:
+            self.monitor_log_pushed.extend( log_results );
+            return
+
+        # Skip anything the backlog already covered
+        await self._write_events( [ log_entry for log_entry in log_results if log_entry[ 'id' ] > self.log_last_id ] );
+
     @qtinter.asyncslot
     async def _monitor_log( self ):
         """
-        Monitors the event log and if new data is available, writes to the
-        log.
+        Reads the event log backlog and writes it to the log. Anything logged
+        after this is pushed to event_log_push.
         """
-        async with self.monitor_log_lock:
-            # Attempt to pull the latest results based on the last log offset
-            log_results = await self.ghost.rpc.teamserver_event_log_get( self.log_offset );
+        try:
+            while True:
+                # Attempt to pull the latest results after the last event we read
+                log_results = await self.ghost.rpc.teamserver_event_log_get( 0, self.log_last_id );
+
+                # No results were returned. Caught up
+                if not log_results:
+                    break
 
-            # No results were returned. Abort
-            if not log_results:
-                return
+                # Write them out
+                await self._write_events( log_results );
+        finally:
+            # Write what was pushed meanwhile, skipping anything the backlog covered
+            log_results, self.monitor_log_pushed = self.monitor_log_pushed, None
+
+            await self._write_events( [ log_entry for log_entry in log_results if log_entry[ 'id' ] > self.log_last_id ] );
+
+    async def _write_events( self, log_results ):
+        """
+        Writes the events to the log and moves the last event id forward.
+        """
+        # No results were returned. Abort
+        if not log_results:
+            return
 
-            # Set the last log offset 
-            self.log_offset += len( log_results );
+        # Set the last event id
+        self.log_last_id = log_results[ -1 ][ 'id' ];
 
-            # Loop through the list of log results
-            for log_entry in log_results:
+        # Loop through the list of log results
+        for log_entry in log_results:
 
-                # Format the incoming timestamp to a string we can read
-                time_stamp = ''
+            # Format the incoming timestamp to a string we can read
+            time_stamp = ''
 
-                if log_entry[ 'type' ] == types.EventLogType.INFO:
-                    # Format the message!
-                    log_message = f'[<font color="Aqua">*</font>] {log_entry[ "message" ]}'
+            if log_entry[ 'type' ] == types.EventLogType.INFO:
+                # Format the message!
+                log_message = f'[<font color="Aqua">*</font>] {log_entry[ "message" ]}'
 
-                    # Write the message
-                    await self.write_to_log( log_message );
-                if log_entry[ 'type' ] == types.EventLogType.GOOD:
-                    # Format the message!
-                    log_message = f'[<font color="Light Green">+</font>] {log_entry[ "message" ]}'
+                # Write the message
+                await self.write_to_log( log_message );
+            if log_entry[ 'type' ] == types.EventLogType.GOOD:
+                # Format the message!
+                log_message = f'[<font color="Light Green">+</font>] {log_entry[ "message" ]}'
 
-                    # Write the message
-                    await self.write_to_log( log_message );
-                if log_entry[ 'type' ] == types.EventLogType.ERROR:
-                    # Format the message!
-                    log_message = f'[<font color="Red">-</font>] {log_entry[ "message" ]}'
+                # Write the message
+                await self.write_to_log( log_message );
+            if log_entry[ 'type' ] == types.EventLogType.ERROR:
+                # Format the message!
+                log_message = f'[<font color="Red">-</font>] {log_entry[ "message" ]}'
 
-                    # Write the message
-                    await self.write_to_log( log_message );
+                # Write the message
+                await self.write_to_log( log_message );
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import PyQt5
+import asyncio
+import qtinter
+
+# Milliseconds between refreshes
+METRICS_REFRESH_INTERVAL = 2000
+
+class TeamserverMetricsTab( PyQt5.QtWidgets.QWidget ):
+    """
+    A 'tab' for viewing the teamservers counters and per stage latencies.
+    """
+    COLUMN_NAMES = [ "Stage", "Calls", "Errors", "Total (ms)", "p50 (ms)", "p99 (ms)" ]
+    COLUMN_COUNT = len( COLUMN_NAMES );
+
+    def __init__( self, ghost ):
+        # Initialize the parent
+        super( PyQt5.QtWidgets.QWidget, self ).__init__( ghost );
+
+        # Set the ghost object
+        self.ghost = ghost
+
+        # Set the output layout
+        self.layout = PyQt5.QtWidgets.QVBoxLayout();
+
+        # Label for the counters
+        self.counters = PyQt5.QtWidgets.QLabel();
+
+        # Table for the stages
+        self.stage_table = PyQt5.QtWidgets.QTableWidget();
+        self.stage_table.setShowGrid( False );
+        self.stage_table.setFocusPolicy( PyQt5.QtCore.Qt.NoFocus );
+        self.stage_table.setEditTriggers( PyQt5.QtWidgets.QAbstractItemView.NoEditTriggers );
+        self.stage_table.setColumnCount( self.COLUMN_COUNT );
+        self.stage_table.setHorizontalHeaderLabels( self.COLUMN_NAMES );
+        self.stage_table.verticalHeader().setVisible( False );
+
+        # Loop through each column
+        for i in range( 0, self.COLUMN_COUNT ):
+            # Request that the column be stretched to fit the table view
+            self.stage_table.horizontalHeader().setSectionResizeMode( i, PyQt5.QtWidgets.QHeaderView.Stretch );
+
+        # Add the widgets to the layout
+        self.layout.addWidget( self.counters );
+        self.layout.addWidget( self.stage_table );
+
+        # Lock for monitoring metrics
+        self.monitor_metrics_lock = asyncio.Lock();
+
+        # Timer for refreshing the metrics
+        self.monitor_metrics = PyQt5.QtCore.QTimer();
+        self.monitor_metrics.setInterval( METRICS_REFRESH_INTERVAL );
+        self.monitor_metrics.timeout.connect( self._monitor_metrics );
+        self.monitor_metrics.start()
+
+        # Set the layout
+        self.setLayout( self.layout );
+
+        # Fill it in straight away
+        PyQt5.QtCore.QTimer.singleShot( 0, self._monitor_metrics );
+
+    @qtinter.asyncslot
+    async def _monitor_metrics( self ):
+        """
+        Requests the latest metrics and displays them.
+        """
+        # Skip while hidden, or if the last refresh has not finished
+        if not self.isVisible() or self.monitor_metrics_lock.locked():
+            return
+
+        async with self.monitor_metrics_lock:
+            # Request the metrics
+            metrics = await self.ghost.rpc.teamserver_metrics_get();
+
+            # Display the counters
+            self.counters.setText( '  '.join( f'{name}: {value}' for name, value in sorted( metrics[ 'counters' ].items() ) ) );
+
+            # Display a row per stage
+            self.stage_table.setRowCount( len( metrics[ 'stages' ] ) );
+
+            for row, stage in enumerate( metrics[ 'stages' ] ):
+                for column, value in enumerate( [ stage[ 'stage' ],
+                                                  str( stage[ 'count' ] ),
+                                                  str( stage[ 'errors' ] ),
+                                                  f'{stage[ "seconds" ] * 1000:.1f}',
+                                                  f'{stage[ "p50" ] * 1000:.2f}' if stage[ 'p50' ] is not None else '-',
+                                                  f'{stage[ "p99" ] * 1000:.2f}' if stage[ 'p99' ] is not None else '-' ] ):
+                    # Set the cell text
+                    self.stage_table.setItem( row, column, PyQt5.QtWidgets.QTableWidgetItem( value ) );
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) );
+
+from lib import database
+
+class LegacyQueues:
+    """
+    The original list + global lock queue table, kept here as the baseline
+    to compare against.
+    """
+    def __init__( self, agent_ids ):
+        self.agent_list_lock = asyncio.Lock()
+        self.agent_list = [ { 'id': agent_id, 'queue': asyncio.Queue() } for agent_id in agent_ids ]
+
+    async def database_agent_add_queue( self, agent_id, message ):
+        async with self.agent_list_lock:
+            agent_queue = [ agent[ 'queue' ] for agent in self.agent_list if agent[ 'id' ] == agent_id ][ 0 ]
+
+            await agent_queue.put( message );
+
+    async def database_agent_get_queue( self, agent_id ):
+        async with self.agent_list_lock:
+            return_buff = b''
+
+            agent_queue = [ agent[ 'queue' ] for agent in self.agent_list if agent[ 'id' ] == agent_id ][ 0 ]
+
+            while agent_queue.qsize() != 0:
+                return_buff += await agent_queue.get()
+
+            return return_buff
+
+async def run( queues, agent_ids, polls_per_agent, enqueues ):
+    """
+    Polls every agent polls_per_agent times while an operator task enqueues
+    messages to random agents concurrently. Returns the elapsed time.
+    """
+    async def agent( agent_id ):
+        for _ in range( polls_per_agent ):
+            await queues.database_agent_get_queue( agent_id );
+            await asyncio.sleep( 0 );
+
+    async def operator():
+        for _ in range( enqueues ):
+            await queues.database_agent_add_queue( random.choice( agent_ids ), b'A' * 64 );
+            await asyncio.sleep( 0 );
+
+    start = time.perf_counter();
+    await asyncio.gather( operator(), *[ agent( agent_id ) for agent_id in agent_ids ] );
+    return time.perf_counter() - start
+
+async def main():
+    agent_ids = random.sample( range( 1, 2 ** 32 ), 5000 );
+    polls_per_agent = 4
+    enqueues = 20000
+
+    # Build the dictionary based table without touching SQLite
+    dbs = database.Database( None );
+
+    for agent_id in agent_ids:
+        dbs._agent_queue_create( agent_id );
+
+    for label, queues in [ ( 'legacy list', LegacyQueues( agent_ids ) ), ( 'scheduler', dbs ) ]:
+        elapsed = await run( queues, agent_ids, polls_per_agent, enqueues );
+        print( f'{label:<24} {elapsed * 1000:10.1f} ms  {( len( agent_ids ) * polls_per_agent + enqueues ) / elapsed:12.0f} ops/s' );
+
+if __name__ in '__main__':
+    asyncio.run( main() );
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) );
+
+from lib import arc4
+
+def legacy_arc4( key, data ):
+    """
+    A plain per-byte ARC4, the baseline to compare against.
+    """
+    state = list( range( 256 ) );
+    j = 0
+
+    for i in range( 256 ):
+        j = ( j + state[ i ] + key[ i % len( key ) ] ) & 0xFF
+        state[ i ], state[ j ] = state[ j ], state[ i ]
+
+    i = j = 0
+    out = bytearray( len( data ) );
+
+    for n in range( len( data ) ):
+        i = ( i + 1 ) & 0xFF
+        j = ( j + state[ i ] ) & 0xFF
+        state[ i ], state[ j ] = state[ j ], state[ i ]
+        out[ n ] = data[ n ] ^ state[ ( state[ i ] + state[ j ] ) & 0xFF ]
+
+    return bytes( out )
+
+def measure( label, function, messages ):
+    """
+    Runs the function over every message and prints the throughput.
+    """
+    total = sum( len( message ) for message in messages );
+    start = time.perf_counter();
+
+    for message in messages:
+        function( message );
+
+    elapsed = time.perf_counter() - start
+    print( f'{label:<40} {total / elapsed / ( 1024 * 1024 ):10.1f} MB/s' );
+
+def check():
+    """
+    Checks the codec against known answers before measuring it.
+    """
+    # RFC 6229, key 0102030405, keystream offsets 0 and 16
+    assert arc4.Arc4( bytes.fromhex( '0102030405' ) ).process( bytes( 32 ) ) == bytes.fromhex( 'b2396305f03dc027ccc3524a0a1118a86982944f18fc82d589c403a47a0d0919' );
+
+    # The classic Key / Plaintext and Wiki / pedia vectors
+    assert arc4.Arc4( b'Key' ).process( b'Plaintext' ) == bytes.fromhex( 'bbf316e8d940af0ad3' );
+    assert arc4.Arc4( b'Wiki' ).process( b'pedia' ) == bytes.fromhex( '1021bf0420' );
+
+    # A message streamed in uneven chunks matches it processed whole, and
+    # the per-byte loop, whether the keystream is cold or already cached
+    message = os.urandom( 100000 );
+
+    for codec in [ arc4.Arc4( b'ghost-check-key' ) ] * 2:
+        stream = codec.stream();
+        chunked = b''.join( stream.process( message[ offset : offset + 1337 ] ) for offset in range( 0, len( message ), 1337 ) );
+
+        assert chunked == codec.process( message ) == legacy_arc4( b'ghost-check-key', message );
+
+    print( 'known answers: ok' );
+
+def main():
+    key = b'ghost-benchmark-key'
+
+    check();
+
+    # ICMP sized messages and a larger task output
+    for label, size, count in [ ( '1400 B', 1400, 2000 ), ( '64 KB', 64 * 1024, 64 ), ( '1 MB', 1024 * 1024, 4 ) ]:
+        messages = [ os.urandom( size ) for _ in range( count ) ];
+        codec = arc4.Arc4( key );
+
+        measure( f'{label} per-byte loop', lambda message: legacy_arc4( key, message ), messages );
+        measure( f'{label} codec, cold keystream', codec.process, messages[ : 1 ] );
+        measure( f'{label} codec, cached keystream', codec.process, messages );
+
+        # Streaming the same messages in ICMP sized chunks
+        def stream( message ):
+            stream = codec.stream();
+
+            for offset in range( 0, len( message ), 1400 ):
+                stream.process( message[ offset : offset + 1400 ] );
+
+        measure( f'{label} codec, 1400 B chunk stream', stream, messages );
+
+    print( f'numpy: {"yes" if arc4.numpy is not None else "no ( big integer XOR fallback )"}' );
+
+if __name__ in '__main__':
+    main();
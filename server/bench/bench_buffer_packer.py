@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+from struct import pack
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) );
+
+from lib import buffer
+
+class LegacyPacker:
+    """
+    The original concatenating packer, kept here as the baseline to compare against.
+    """
+    def __init__( self ):
+        self.buffer : bytes = b''
+
+    def get_packed( self ):
+        return self.buffer
+
+    def add_buffer( self, buffer ):
+        buf  = pack( '<I', len( buffer ) );
+        buf += buffer
+
+        self.buffer = self.buffer + buf
+
+    def add_int32( self, integer ):
+        buf = pack( '<I', integer )
+
+        self.buffer = self.buffer + buf
+
+def pack_small_tasks( packer_class, task_count ):
+    """
+    Packs task_count small tasks ( id, type, 64 byte argument ) into one blob.
+    """
+    start = time.perf_counter();
+    packer = packer_class();
+    argument = b'A' * 64
+
+    for task_id in range( task_count ):
+        packer.add_int32( task_id );
+        packer.add_int32( 1 );
+        packer.add_buffer( argument );
+
+    packed = packer.get_packed();
+    return time.perf_counter() - start, len( packed )
+
+def pack_upload( packer_class, upload ):
+    """
+    Packs a single large file upload behind its task header.
+    """
+    start = time.perf_counter();
+    packer = packer_class();
+
+    packer.add_int32( 0 );
+    packer.add_int32( 2 );
+    packer.add_buffer( upload );
+
+    packed = packer.get_packed();
+    return time.perf_counter() - start, len( packed )
+
+def report( label, elapsed, size ):
+    print( f'{label:<28} {elapsed * 1000:10.3f} ms  {size / elapsed / ( 1024 * 1024 ):10.1f} MB/s' );
+
+def main():
+    report( 'legacy 10k small tasks', *pack_small_tasks( LegacyPacker, 10000 ) );
+    report( 'bytearray 10k small tasks', *pack_small_tasks( buffer.Packer, 10000 ) );
+
+    # A 50 MB upload is the worst case for per-field reallocation
+    upload = os.urandom( 50 * 1024 * 1024 );
+
+    report( 'legacy 50 MB upload', *pack_upload( LegacyPacker, upload ) );
+    report( 'bytearray 50 MB upload', *pack_upload( buffer.Packer, upload ) );
+
+if __name__ in '__main__':
+    main();
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+from struct import pack
+from struct import unpack
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) );
+
+from lib import buffer
+
+class LegacyParser:
+    """
+    The original slicing parser, kept here as the baseline to compare against.
+    """
+    def __init__( self, buffer ):
+        self.buffer : bytes = buffer
+
+    def get_buffer( self ):
+        siz = unpack( '<I', self.buffer[ : 4 ] )[0]
+        buf = self.buffer[ 4 : 4 + siz ]
+
+        self.buffer = self.buffer[ 4 + siz : ]
+
+        return buf
+
+    def get_int32( self ):
+        lnn = unpack( '<I', self.buffer[ : 4 ] )[0]
+
+        self.buffer = self.buffer[ 4 : ]
+
+        return lnn
+
+    def get_size_left( self ):
+        return len( self.buffer )
+
+def build_message( message_size ):
+    """
+    Builds a message of alternating int32 and 32 byte buffer fields that is
+    roughly message_size bytes long.
+    """
+    field = pack( '<I', 0x41414141 ) + pack( '<I', 32 ) + b'B' * 32
+    count = max( 1, message_size // len( field ) )
+
+    return field * count
+
+def run_parser( parser_class, message ):
+    """
+    Decodes every field within the message and returns the elapsed time.
+    """
+    start = time.perf_counter();
+    bfparser = parser_class( message );
+
+    # Read until the message is exhausted
+    while bfparser.get_size_left() > 0:
+        bfparser.get_int32();
+        bfparser.get_buffer();
+
+    return time.perf_counter() - start
+
+def main():
+    for label, message_size in [ ( '1 KB', 1024 ), ( '64 KB', 64 * 1024 ), ( '8 MB', 8 * 1024 * 1024 ) ]:
+        # Build the message once and reuse it for both parsers
+        message = build_message( message_size );
+
+        new_time = run_parser( buffer.Parser, message );
+
+        # The legacy parser is quadratic, so avoid waiting minutes on 8 MB
+        if message_size <= 1024 * 1024:
+            old_time = run_parser( LegacyParser, message );
+            print( f'{label:>6}: legacy {old_time * 1000:10.3f} ms  memoryview {new_time * 1000:10.3f} ms  speedup {old_time / new_time:8.1f}x' );
+        else:
+            print( f'{label:>6}: legacy    skipped ( quadratic )  memoryview {new_time * 1000:10.3f} ms' );
+
+if __name__ in '__main__':
+    main();
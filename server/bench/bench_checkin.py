@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) );
+
+from lib import types
+from lib import database
+
+class BenchGhost:
+    """
+    The parts of the Ghost class the database and callbacks touch.
+    """
+    def __init__( self ):
+        self.log = logging.getLogger( 'ghost' );
+        self.rpc = self
+        self.dbs = database.Database( self );
+
+    def rpc_notify( self, method, argument, item ):
+        pass
+
+async def checkin_separate( ghost, agent_id ):
+    """
+    A check-in as it was written before units of work: the agent insert and
+    the event each commit on their own.
+    """
+    await ghost.dbs.database_agent_add( agent_id, 10, 0, 19041, 1000, 4, 'explorer.exe' );
+    await ghost.dbs.database_event_add( types.EventLogType.GOOD, f'New agent established -> ID: {agent_id}', durable = True );
+
+async def checkin_transaction( ghost, agent_id ):
+    """
+    A check-in as Callback.callback_init writes it: a single unit of work.
+    """
+    async with ghost.dbs.transaction() as tx:
+        await ghost.dbs.database_agent_add( agent_id, 10, 0, 19041, 1000, 4, 'explorer.exe', tx = tx );
+        await ghost.dbs.database_event_add( types.EventLogType.GOOD, f'New agent established -> ID: {agent_id}', tx = tx );
+
+async def run( label, checkin, agent_count, concurrency ):
+    """
+    Runs agent_count check-ins, concurrency at a time, against a fresh database.
+    """
+    os.chdir( tempfile.mkdtemp() );
+
+    ghost = BenchGhost();
+    await ghost.dbs.start();
+
+    async def worker( agent_ids ):
+        for agent_id in agent_ids:
+            await checkin( ghost, agent_id );
+
+    start = time.perf_counter();
+    await asyncio.gather( *[ worker( range( index + 1, agent_count + 1, concurrency ) ) for index in range( concurrency ) ] );
+    await ghost.dbs.database_log_flush();
+    elapsed = time.perf_counter() - start
+
+    await ghost.dbs.stop();
+
+    print( f'{label:<24} {agent_count} check-ins in {elapsed:8.3f} s  {agent_count / elapsed:10.1f} check-ins/s' );
+
+async def main():
+    await run( 'separate commits', checkin_separate, 2000, 16 );
+    await run( 'single transaction', checkin_transaction, 2000, 16 );
+
+if __name__ in '__main__':
+    asyncio.run( main() );
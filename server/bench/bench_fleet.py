@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import tempfile
+import platform
+import statistics
+import subprocess
+import asyncclick
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) );
+
+from lib import sck
+from lib import arc4
+from lib import buffer
+from lib import callback
+
+from fastapi_websocket_rpc import RpcMethodsBase
+from fastapi_websocket_rpc import WebSocketRpcClient
+
+# The teamserver entrypoint
+GHOST_PATH = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'ghost.py' );
+
+# Seconds to wait for a reply before sending a fragment again, and how often
+FRAGMENT_TIMEOUT = 1.0
+FRAGMENT_RETRIES = 10
+
+# Seconds between probes while waiting for the listener, and how many
+LISTENER_PROBE_INTERVAL = 0.1
+LISTENER_PROBES = 600
+
+def free_port( kind ):
+    """
+    Returns a port nothing is listening on.
+    """
+    with socket.socket( socket.AF_INET, kind ) as probe:
+        probe.bind( ( '127.0.0.1', 0 ) );
+        return probe.getsockname()[ 1 ]
+
+def percentiles( samples ):
+    """
+    Returns the p50 and p99 of the samples, in milliseconds.
+    """
+    if len( samples ) < 2:
+        return None, None
+
+    cuts = statistics.quantiles( samples, n = 100 );
+
+    return cuts[ 49 ] * 1000, cuts[ 98 ] * 1000
+
+class Fleet( asyncio.DatagramProtocol ):
+    """
+    The simulated agents' side of the UDP transport. Every agent shares one
+    socket and has at most one fragment in flight, so replies are matched to
+    agents by the agent_id they start with.
+    """
+    def __init__( self, key, chunk_length ):
+        # set the key and fragment size the agents use
+        self.codec = arc4.get( key );
+        self.chunk_length = chunk_length
+
+        # the datagram endpoint and the reply each agent is waiting on
+        self.transport = None
+        self.waiters = {}
+
+        # round trip of every fragment, and counts of what was sent
+        self.round_trips = []
+        self.stats = { 'fragments': 0, 'retries': 0, 'messages': 0, 'checkins': 0, 'polls': 0, 'failures': 0 };
+
+    def error_received( self, exception ):
+        # Nothing listening yet, the fragment is sent again
+        pass
+
+    def datagram_received( self, data, address ):
+        waiter = self.waiters.pop( sck.FRAGMENT_SCHEMA.prefix.unpack_from( data )[ 0 ], None );
+
+        if waiter is not None and not waiter.done():
+            waiter.set_result( data );
+
+    async def exchange( self, agent_id, fragment ):
+        """
+        Sends a fragment and waits for its reply, sending it again if lost.
+        """
+        loop = asyncio.get_running_loop();
+
+        for _ in range( FRAGMENT_RETRIES ):
+            waiter = self.waiters[ agent_id ] = loop.create_future();
+            start = time.perf_counter();
+
+            self.transport.sendto( fragment );
+            self.stats[ 'fragments' ] += 1
+
+            try:
+                reply = await asyncio.wait_for( waiter, FRAGMENT_TIMEOUT );
+            except asyncio.TimeoutError:
+                self.stats[ 'retries' ] += 1
+                continue
+
+            self.round_trips.append( time.perf_counter() - start );
+
+            return reply
+
+        raise TimeoutError( f'agent {agent_id} got no reply' );
+
+    async def ready( self ):
+        """
+        Waits until the listener answers a poll from agent 0, which no agent
+        uses, so the fleet is not timed against a port that is not open yet.
+        """
+        loop = asyncio.get_running_loop();
+
+        for _ in range( LISTENER_PROBES ):
+            waiter = self.waiters[ 0 ] = loop.create_future();
+            self.transport.sendto( sck.FRAGMENT_SCHEMA.prefix.pack( 0, 0, 0, self.chunk_length, 0 ) );
+
+            try:
+                await asyncio.wait_for( waiter, LISTENER_PROBE_INTERVAL );
+                return
+            except asyncio.TimeoutError:
+                continue
+
+        raise TimeoutError( 'the listener never answered' );
+
+    async def send( self, agent_id, message_id, callback_id, body ):
+        """
+        Encrypts a callback message and sends it fragment by fragment.
+        """
+        message = buffer.Packer();
+        message.add_int8( callback_id );
+        message.add_buffer( body );
+        message = self.codec.process( message.get_packed() );
+
+        for index, offset in enumerate( range( 0, len( message ), self.chunk_length ) ):
+            await self.exchange( agent_id, sck.FRAGMENT_SCHEMA.prefix.pack( agent_id, message_id, len( message ), self.chunk_length, index ) + message[ offset : offset + self.chunk_length ] );
+
+        self.stats[ 'messages' ] += 1
+
+    async def agent( self, agent_id, sleep, jitter, output_size, output_ratio, stopped ):
+        """
+        One agent: checks in, then every sleep +/- jitter seconds either
+        sends output or polls for tasks until stopped.
+        """
+        try:
+            # Check in as CALLBACK_INIT
+            body = buffer.Packer();
+            body.add_int8( 1 );
+            body.add_int32_many( [ 10, 0, 19041, random.randrange( 1, 65536 ), 4 ] );
+            body.add_stringw( 'explorer.exe' );
+
+            await self.send( agent_id, 1, callback.CALLBACK_INIT, body.get_packed() );
+            self.stats[ 'checkins' ] += 1
+
+            message_id = 1
+
+            while not stopped.is_set():
+                # Sleep, spread by the jitter
+                await asyncio.sleep( sleep * ( 1 + random.uniform( -jitter, jitter ) ) );
+
+                if random.random() < output_ratio:
+                    # Send output as CALLBACK_OUTPUT
+                    message_id += 1
+                    body = buffer.Packer();
+                    body.add_int8( 0 );
+                    body.add_buffer( random.randbytes( output_size // 2 ).hex().encode() );
+
+                    await self.send( agent_id, message_id, callback.CALLBACK_OUTPUT, body.get_packed() );
+                else:
+                    # Poll for tasks with a header only fragment
+                    await self.exchange( agent_id, sck.FRAGMENT_SCHEMA.prefix.pack( agent_id, 0, 0, self.chunk_length, 0 ) );
+                    self.stats[ 'polls' ] += 1
+        except TimeoutError:
+            self.stats[ 'failures' ] += 1
+
+class OperatorMethods( RpcMethodsBase ):
+    """
+    The pushes a simulated operator receives. Only counted.
+    """
+    def __init__( self, pushes ):
+        super().__init__();
+        self.pushes = pushes
+
+    async def teamserver_event_log_push( self, events : list = [] ):
+        self.pushes[ 'events' ] += len( events );
+
+    async def teamserver_agent_list_push( self, versions : list = [] ):
+        self.pushes[ 'agents' ] += len( versions );
+
+    async def teamserver_agent_log_push( self, cursors : list = [] ):
+        self.pushes[ 'cursors' ] += len( cursors );
+
+async def operator( url, interval, agent_count, latencies, pushes, stopped ):
+    """
+    One operator: follows the event log, agent list and a random agent's
+    console with cursors every interval seconds, as the client does.
+    """
+    async with WebSocketRpcClient( url, OperatorMethods( pushes ) ) as client:
+        event_last_id = 0
+        agent_version = 0
+        agent_log_cursors = {}
+
+        while not stopped.is_set():
+            start = time.perf_counter();
+
+            # The agent table and event log
+            agent_version = ( await client.other.teamserver_agent_list_diff( since_version = agent_version ) ).result[ 'version' ];
+            events = ( await client.other.teamserver_event_log_get( log_offset = 0, last_id = event_last_id ) ).result
+            event_last_id = events[ -1 ][ 'id' ] if events else event_last_id
+
+            # A console
+            agent_id = random.randrange( 1, agent_count + 1 );
+            entries = ( await client.other.teamserver_agent_log_get( agent_id = agent_id, after_id = agent_log_cursors.get( agent_id, 0 ), limit = 256 ) ).result
+            agent_log_cursors[ agent_id ] = entries[ -1 ][ 'id' ] if entries else agent_log_cursors.get( agent_id, 0 );
+
+            latencies.append( time.perf_counter() - start );
+
+            await asyncio.sleep( interval );
+
+def process_memory( pid ):
+    """
+    Returns the current and peak resident set size of the process in MB.
+    """
+    fields = {}
+
+    with open( f'/proc/{pid}/status' ) as status:
+        for line in status:
+            name, _, value = line.partition( ':' );
+            fields[ name ] = value.split()
+
+    return int( fields[ 'VmRSS' ][ 0 ] ) / 1024, int( fields[ 'VmHWM' ][ 0 ] ) / 1024
+
+def stage( snapshot, name ):
+    """
+    Returns the stage's entry in a metrics snapshot.
+    """
+    return next( ( entry for entry in snapshot[ 'stages' ] if entry[ 'stage' ] == name ), { 'count': 0, 'p50': None, 'p99': None } );
+
+async def run( agents, operators, duration, sleep, jitter, output_size, output_ratio, chunk_length, operator_interval, workers ):
+    """
+    Starts a teamserver on the UDP transport, drives the fleet and operators
+    against it and returns the results.
+    """
+    rpc_port = free_port( socket.SOCK_STREAM );
+    udp_port = free_port( socket.SOCK_DGRAM );
+    key = 'ghost-fleet-key'
+
+    # Start a teamserver with its own database
+    teamserver = subprocess.Popen( [ sys.executable, os.path.abspath( GHOST_PATH ), '--transport', 'udp', '--workers', str( workers ), '127.0.0.1', str( rpc_port ), f'127.0.0.1:{udp_port}', key ],
+                                   cwd = tempfile.mkdtemp(), stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL );
+
+    try:
+        url = f'ws://127.0.0.1:{rpc_port}/ws'
+
+        # Wait for it to come up
+        for _ in range( 100 ):
+            try:
+                async with WebSocketRpcClient( url, OperatorMethods( { 'events': 0, 'agents': 0, 'cursors': 0 } ) ) as client:
+                    await client.other.teamserver_metrics_get();
+                break
+            except OSError:
+                await asyncio.sleep( 0.1 );
+
+        loop = asyncio.get_running_loop();
+        fleet = Fleet( key, chunk_length );
+        fleet.transport, _ = await loop.create_datagram_endpoint( lambda: fleet, remote_addr = ( '127.0.0.1', udp_port ) );
+
+        # The RPC server comes up before the listener, so wait for that too
+        await fleet.ready();
+
+        stopped = asyncio.Event();
+        latencies = []
+        pushes = { 'events': 0, 'agents': 0, 'cursors': 0 };
+
+        async with WebSocketRpcClient( url, OperatorMethods( { 'events': 0, 'agents': 0, 'cursors': 0 } ) ) as monitor:
+            # Check the fleet in and run it, with the operators
+            start = time.perf_counter();
+            tasks = [ asyncio.create_task( fleet.agent( agent_id, sleep, jitter, output_size, output_ratio, stopped ) ) for agent_id in range( 1, agents + 1 ) ];
+            tasks += [ asyncio.create_task( operator( url, operator_interval, agents, latencies, pushes, stopped ) ) for _ in range( operators ) ];
+
+            # Measure the steady state once every agent has checked in
+            while fleet.stats[ 'checkins' ] + fleet.stats[ 'failures' ] < agents:
+                await asyncio.sleep( 0.1 );
+
+            checkin_elapsed = time.perf_counter() - start
+            before = ( await monitor.other.teamserver_metrics_get() ).result
+            start = time.perf_counter();
+            messages = fleet.stats[ 'messages' ]
+            round_trips = len( fleet.round_trips );
+
+            await asyncio.sleep( duration );
+
+            elapsed = time.perf_counter() - start
+            after = ( await monitor.other.teamserver_metrics_get() ).result
+            rss, rss_peak = process_memory( teamserver.pid );
+
+            # Let everyone finish what they are doing
+            stopped.set();
+            await asyncio.gather( *tasks, return_exceptions = True );
+
+        fleet.transport.close();
+
+        def delta( name ):
+            return after[ 'counters' ].get( name, 0 ) - before[ 'counters' ].get( name, 0 )
+
+        # The snapshot only carries cumulative quantiles, so this covers the
+        # check-in phase as well as the steady state
+        dispatch = stage( after, 'callback_dispatch' );
+        round_trip_p50, round_trip_p99 = percentiles( fleet.round_trips[ round_trips : ] );
+        operator_p50, operator_p99 = percentiles( latencies );
+
+        return { 'checkin_phase': { 'agents': fleet.stats[ 'checkins' ], 'seconds': checkin_elapsed, 'checkins_per_second': fleet.stats[ 'checkins' ] / checkin_elapsed },
+                 'steady_phase': { 'seconds': elapsed,
+                                   'messages_per_second': ( fleet.stats[ 'messages' ] - messages ) / elapsed,
+                                   'listener_messages_per_second': delta( 'listener_messages' ) / elapsed,
+                                   'listener_fragments_per_second': delta( 'listener_fragments' ) / elapsed,
+                                   'db_rows_per_second': ( delta( 'database_event_rows' ) + delta( 'database_agent_log_rows' ) ) / elapsed,
+                                   'fragment_round_trip_p50_ms': round_trip_p50,
+                                   'fragment_round_trip_p99_ms': round_trip_p99 },
+                 'callback_dispatch_whole_run': { 'count': dispatch[ 'count' ],
+                                        'p50_ms': dispatch[ 'p50' ] * 1000 if dispatch[ 'p50' ] is not None else None,
+                                        'p99_ms': dispatch[ 'p99' ] * 1000 if dispatch[ 'p99' ] is not None else None },
+                 'operators': { 'requests': len( latencies ), 'poll_p50_ms': operator_p50, 'poll_p99_ms': operator_p99, 'pushes': pushes },
+                 'teamserver': { 'rss_mb': rss, 'rss_peak_mb': rss_peak },
+                 'fleet': fleet.stats };
+    finally:
+        teamserver.terminate();
+        teamserver.wait();
+
+@asyncclick.command()
+@asyncclick.option( '--agents', type = int, default = 500, show_default = True, help = 'Simulated agents.' )
+@asyncclick.option( '--operators', type = int, default = 5, show_default = True, help = 'Simulated operators.' )
+@asyncclick.option( '--duration', type = float, default = 30, show_default = True, help = 'Seconds to measure once every agent has checked in.' )
+@asyncclick.option( '--sleep', type = float, default = 1.0, show_default = True, help = 'Seconds each agent sleeps between callbacks.' )
+@asyncclick.option( '--jitter', type = float, default = 0.3, show_default = True, help = 'Fraction the sleep is randomly spread by.' )
+@asyncclick.option( '--output-size', type = int, default = 4096, show_default = True, help = 'Bytes of output per output callback.' )
+@asyncclick.option( '--output-ratio', type = float, default = 0.2, show_default = True, help = 'Fraction of callbacks that send output rather than poll.' )
+@asyncclick.option( '--chunk-length', type = int, default = 1024, show_default = True, help = 'Bytes of message per fragment.' )
+@asyncclick.option( '--operator-interval', type = float, default = 1.0, show_default = True, help = 'Seconds between each operator poll.' )
+@asyncclick.option( '--workers', type = int, default = 0, show_default = True, help = 'Teamserver --workers.' )
+@asyncclick.option( '--output', type = str, default = 'bench-fleet.jsonl', show_default = True, help = 'File each run is appended to as a JSON line.' )
+async def main( agents, operators, duration, sleep, jitter, output_size, output_ratio, chunk_length, operator_interval, workers, output ):
+    """
+    Simulates a fleet of agents and operators against a local teamserver
+    and records how it holds up.
+    """
+    results = await run( agents, operators, duration, sleep, jitter, output_size, output_ratio, chunk_length, operator_interval, workers );
+
+    # Record the run with what it ran against
+    try:
+        commit = subprocess.run( [ 'git', 'rev-parse', '--short', 'HEAD' ], cwd = os.path.dirname( os.path.abspath( __file__ ) ), capture_output = True, text = True ).stdout.strip()
+    except OSError:
+        commit = ''
+
+    record = { 'time': time.strftime( '%Y-%m-%dT%H:%M:%S' ),
+               'commit': commit,
+               'python': platform.python_version(),
+               'parameters': { 'agents': agents, 'operators': operators, 'duration': duration, 'sleep': sleep, 'jitter': jitter, 'output_size': output_size,
+                               'output_ratio': output_ratio, 'chunk_length': chunk_length, 'operator_interval': operator_interval, 'workers': workers },
+               'results': results };
+
+    with open( output, 'a' ) as file:
+        file.write( json.dumps( record ) + '\n' );
+
+    print( json.dumps( results, indent = 2 ) );
+
+if __name__ in '__main__':
+    main();
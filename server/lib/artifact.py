@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import mmap
+
+class Artifact:
+    """
+    A compiled agent artifact kept memory-mapped between exports. The file
+    is only remapped when its modification time or size changes on disk.
+    """
+    def __init__( self, path ):
+        # set the path to the artifact
+        self.path = path
+
+        # the current mapping and the ( mtime, size ) it was taken at
+        self.artifact_map = None
+        self.artifact_ver = None
+
+    def get( self ):
+        """
+        Returns the artifact contents, or None if the artifact does not exist.
+        """
+        try:
+            # Has the artifact changed since we mapped it?
+            stat = os.stat( self.path );
+        except FileNotFoundError:
+            # It was removed, drop the stale mapping
+            self.artifact_map = None
+            self.artifact_ver = None
+
+            return None
+
+        # Remap if the file is new or has changed
+        if self.artifact_map is None or self.artifact_ver != ( stat.st_mtime_ns, stat.st_size ):
+            with open( self.path, 'rb' ) as file:
+                # An empty file cannot be mapped
+                self.artifact_map = mmap.mmap( file.fileno(), 0, access = mmap.ACCESS_READ ) if stat.st_size else b''
+                self.artifact_ver = ( stat.st_mtime_ns, stat.st_size )
+
+        return self.artifact_map
@@ -1,111 +1,138 @@
 from struct import pack
-from struct import unpack
+from struct import Struct
+
+# Precompiled little-endian integer layouts
+INT64 = Struct( '<Q' )
+INT32 = Struct( '<I' )
+INT16 = Struct( '<H' )
+INT8  = Struct( '<B' )
 
 class Parser:
+    """
+    Reads fields from a message by advancing a cursor over a memoryview,
+    so no field read ever copies the remainder of the message.
+    """
     def __init__( self, buffer ):
-        self.buffer : bytes = buffer
+        self.buffer : memoryview = memoryview( buffer ).cast( 'B' )
+        self.offset : int = 0
 
     def get_stringw( self ):
-        siz = unpack( '<I', self.buffer[ : 4 ] )[0]
-        buf = self.buffer[ 4 : 4 + siz ][:-2]
-
-        self.buffer = self.buffer[ 4 + siz : ]
+        buf = self.get_buffer()[:-2]
 
-        return buf.decode( 'utf-16-le' )
+        return str( buf, 'utf-16-le' )
 
     def get_string( self ):
-        siz = unpack( '<I', self.buffer[ : 4 ] )[0]
-        buf = self.buffer[ 4 : 4 + siz ][:-1]
+        buf = self.get_buffer()[:-1]
 
-        self.buffer = self.buffer[ 4 + siz : ]
-
-        return buf.decode( 'utf-8' )
+        return str( buf, 'utf-8' )
 
     def get_buffer( self ):
-        siz = unpack( '<I', self.buffer[ : 4 ] )[0]
-        buf = self.buffer[ 4 : 4 + siz ]
+        siz = INT32.unpack_from( self.buffer, self.offset )[0]
+        buf = self.buffer[ self.offset + 4 : self.offset + 4 + siz ]
 
-        self.buffer = self.buffer[ 4 + siz : ]
+        self.offset += 4 + len( buf )
 
         return buf
 
     def get_int64( self ):
-        lnn = unpack( '<Q', self.buffer[ : 8 ] )[0]
+        lnn = INT64.unpack_from( self.buffer, self.offset )[0]
 
-        self.buffer = self.buffer[ 8 : ]
+        self.offset += 8
 
         return lnn
 
     def get_int32( self ):
-        lnn = unpack( '<I', self.buffer[ : 4 ] )[0]
+        lnn = INT32.unpack_from( self.buffer, self.offset )[0]
 
-        self.buffer = self.buffer[ 4 : ]
+        self.offset += 4
 
         return lnn
 
     def get_int16( self ):
-        lnn = unpack( '<H', self.buffer[ : 2 ] )[0]
+        lnn = INT16.unpack_from( self.buffer, self.offset )[0]
 
-        self.buffer = self.buffer[ 2 : ]
+        self.offset += 2
 
         return lnn
 
     def get_int8( self ):
-        lnn = unpack( '<B', self.buffer[ : 1 ] )[0]
+        lnn = INT8.unpack_from( self.buffer, self.offset )[0]
 
-        self.buffer = self.buffer[ 1 : ]
+        self.offset += 1
 
         return lnn
 
+    def get_schema( self, schema ):
+        return schema.unpack( self )
+
     def get_size_left( self ):
-        return len( self.buffer )
+        return len( self.buffer ) - self.offset
 
     def get_buff_left( self ):
-        return self.buffer
+        return self.buffer[ self.offset : ]
+
+class Schema:
+    """
+    A message layout declared once as a fixed-width struct prefix followed
+    by variable-length tail fields ( 'buffer', 'string', 'stringw' ). The
+    prefix is compiled into a single Struct so it decodes in one call.
+    """
+    def __init__( self, prefix, *tail ):
+        self.prefix = Struct( prefix )
+        self.tail   = tuple( getattr( Parser, f'get_{field}' ) for field in tail )
+
+    def unpack( self, parser ):
+        values = self.prefix.unpack_from( parser.buffer, parser.offset )
+
+        parser.offset += self.prefix.size
+
+        return values + tuple( field( parser ) for field in self.tail )
 
 class Packer:
+    """
+    Builds a message by appending fields in place to a single growing
+    bytearray rather than reallocating the whole message per field.
+    """
     def __init__( self ):
-        self.buffer : bytes = b''
+        self.buffer : bytearray = bytearray()
 
     def get_packed( self ):
-        return self.buffer
+        return bytes( self.buffer )
 
     def add_stringw( self, string ):
-        buf  = pack( '<I', len( string.encode( 'utf-16-le' ) ) + 2 )
-        buf += string.encode( 'utf-16-le' )
-        buf += b'\x00\x00'
+        buf = string.encode( 'utf-16-le' )
 
-        self.buffer = self.buffer + buf
+        self.buffer += INT32.pack( len( buf ) + 2 )
+        self.buffer += buf
+        self.buffer += b'\x00\x00'
 
     def add_string( self, string ):
-        buf  = pack( '<I', len( string ) + 1 )
-        buf += string.encode( 'utf-8' )
-        buf += b'\x00'
-
-        self.buffer = self.buffer + buf
+        self.buffer += INT32.pack( len( string ) + 1 )
+        self.buffer += string.encode( 'utf-8' )
+        self.buffer += b'\x00'
 
     def add_buffer( self, buffer ):
-        buf  = pack( '<I', len( buffer ) );
-        buf += buffer
+        self.buffer += INT32.pack( len( buffer ) )
+        self.buffer += buffer
 
-        self.buffer = self.buffer + buf
+    def add_buffers( self, buffers ):
+        for buffer in buffers:
+            self.buffer += INT32.pack( len( buffer ) )
+            self.buffer += buffer
 
     def add_int64( self, integer ):
-        buf = pack( '<Q', integer );
-
-        self.buffer = self.buffer + buf
+        self.buffer += INT64.pack( integer )
 
     def add_int32( self, integer ):
-        buf = pack( '<I', integer )
+        self.buffer += INT32.pack( integer )
 
-        self.buffer = self.buffer + buf
+    def add_int32_many( self, integers ):
+        integers = list( integers )
 
-    def add_int16( self, integer ):
-        buf = pack( '<H', integer )
+        self.buffer += pack( f'<{len( integers )}I', *integers )
 
-        self.buffer = self.buffer + buf
+    def add_int16( self, integer ):
+        self.buffer += INT16.pack( integer )
 
     def add_int8( self, integer ):
-        buf = pack( '<B', integer )
-
-        self.buffer = self.buffer + buf
+        self.buffer += INT8.pack( integer )
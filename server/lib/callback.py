@@ -4,10 +4,58 @@ import asyncio
 
 from lib import buffer
 from lib import types
+from lib import metrics
 
 # Callback types
-CALLBACK_INIT = 0
+CALLBACK_INIT   = 0
+CALLBACK_OUTPUT = 1
 
+# Callback message layouts
+CALLBACK_INIT_SCHEMA   = buffer.Schema( '<BIIIII', 'stringw' )
+CALLBACK_OUTPUT_SCHEMA = buffer.Schema( '<B', 'buffer' )
+
+# Layout of each callback's message
+CALLBACK_SCHEMAS = {
+    CALLBACK_INIT: CALLBACK_INIT_SCHEMA,
+    CALLBACK_OUTPUT: CALLBACK_OUTPUT_SCHEMA,
+}
+
+# Optional fields newer agents append to a callback's message: for
+# CALLBACK_INIT, the sleep in milliseconds, jitter percentage and kill date
+CALLBACK_EXTENSIONS = {
+    CALLBACK_INIT: buffer.Schema( '<IBQ' ),
+}
+
+@metrics.timed( 'callback_decode' )
+def decode( message : bytes ):
+    """
+    Decodes a message into its callback ID and fields. Touches no state, so
+    it can run in a worker process; anything without a known layout keeps
+    the rest of the message as bytes.
+    """
+    # Parse the incoming message
+    bfparser = buffer.Parser( message );
+
+    # Extract the callback ID
+    callback_id = bfparser.get_int8();
+    schema = CALLBACK_SCHEMAS.get( callback_id );
+
+    if schema is None:
+        return callback_id, ( bytes( bfparser.get_buff_left() ), );
+
+    # Skip the length prefix and unpack the callback's layout
+    bfparser = buffer.Parser( bfparser.get_buffer() );
+    fields = bfparser.get_schema( schema );
+
+    # Unpack the optional fields if the agent sent them
+    extension = CALLBACK_EXTENSIONS.get( callback_id );
+
+    if extension is not None and bfparser.get_size_left() >= extension.prefix.size:
+        fields += bfparser.get_schema( extension );
+
+    return callback_id, fields
+
+@metrics.instrument( 'callback_' )
 class Callback:
     """
     Parses the incoming messages and executes the specified action
@@ -17,51 +65,95 @@ class Callback:
         # set the ghost object
         self.ghost = ghost
 
-    async def callback_init( self, agent_id : int, message : bytes ):
+        # handlers for the requests of agents that are alive
+        self.callbacks = { CALLBACK_OUTPUT: self.callback_output };
+
+    async def callback_init( self, agent_id : int, fields : tuple ):
         """
-        Parses a CALLBACK_INIT request and adds an agent to the database.
+        Adds an agent to the database from a decoded CALLBACK_INIT request.
         """
-        # Parse the incoming message!
-        bfparser = buffer.Parser( message );
-
         # Extract the agent request info to submit to the database
-        agent_is64 = bfparser.get_int8();
-        agent_omaj = bfparser.get_int32();
-        agent_omin = bfparser.get_int32();
-        agent_obld = bfparser.get_int32();
-        agent_upid = bfparser.get_int32();
-        agent_ppid = bfparser.get_int32();
-        agent_pexe = bfparser.get_stringw();
+        agent_is64, agent_omaj, agent_omin, agent_obld, agent_upid, agent_ppid, agent_pexe, *agent_timing = fields
 
-        # Add the 'new' agent to the database!
-        await self.ghost.dbs.database_agent_add( agent_id, agent_omaj, agent_omin, agent_obld, agent_upid, agent_ppid, agent_pexe );
+        # Commit the check-in as a single unit of work
+        async with self.ghost.dbs.transaction() as tx:
+            # Add the 'new' agent to the database!
+            await self.ghost.dbs.database_agent_add( agent_id, agent_omaj, agent_omin, agent_obld, agent_upid, agent_ppid, agent_pexe, tx = tx );
 
-        # Print that we got an agent!
-        await self.ghost.dbs.database_event_add( types.EventLogType.GOOD, f'New agent established -> ID: {agent_id} PID: {agent_upid} Process: {agent_pexe} OS: {agent_omaj}.{agent_omin}.{agent_obld}' );
+            # Print that we got an agent!
+            await self.ghost.dbs.database_event_add( types.EventLogType.GOOD, f'New agent established -> ID: {agent_id} PID: {agent_upid} Process: {agent_pexe} OS: {agent_omaj}.{agent_omin}.{agent_obld}', tx = tx );
 
-    async def parse( self, agent_id : int, message : bytes ):
+        # Record the check-in, on the timing it told us if it did
+        await self.ghost.dbs.database_agent_seen( agent_id, *agent_timing );
+
+    async def callback_output( self, agent_id : int, fields : tuple ):
         """
-        Parses the incoming message and executes the requested callback.
+        Appends the output in a decoded CALLBACK_OUTPUT request to the agent's
+        console log.
         """
-        # Determines if this is an existing agent and is still marked as alive
-        is_agent = await self.ghost.dbs.database_agent_is_valid( agent_id );
-        is_alive = await self.ghost.dbs.database_agent_is_alive( agent_id ) if is_agent != False else False
-        
-        # Parse the incoming message
-        bfparser = buffer.Parser( message );
+        # Extract the output type and the raw output
+        log_type, log_output = fields
+
+        # Append it to the console log!
+        await self.ghost.dbs.database_agent_log_add( agent_id, log_type, str( log_output, 'utf-8', 'replace' ) );
+
+    @metrics.timed( 'callback_seen' )
+    async def seen( self, agent_id : int ):
+        """
+        Records contact from an agent, bringing it back to life if it had been
+        marked dead. Returns whether it is a valid agent.
+        """
+        # Is this an existing agent?
+        if not await self.ghost.dbs.database_agent_is_valid( agent_id ):
+            return False
+
+        # Still alive? Push its deadline back
+        if await self.ghost.dbs.database_agent_is_alive( agent_id ):
+            await self.ghost.dbs.database_agent_seen( agent_id );
+            return True
+
+        # Commit the revival as a single unit of work
+        async with self.ghost.dbs.transaction() as tx:
+            # It called back after all!
+            await self.ghost.dbs.database_agent_set_alive( agent_id, True, tx = tx );
+
+            # Print that it is back
+            await self.ghost.dbs.database_event_add( types.EventLogType.INFO, f'Agent is responding again -> ID: {agent_id}', tx = tx );
+
+        # Record this callback
+        await self.ghost.dbs.database_agent_seen( agent_id );
+
+        return True
+
+    @metrics.timed( 'callback_dispatch' )
+    async def dispatch( self, agent_id : int, callback_id : int, fields : tuple ):
+        """
+        Executes the callback for a decoded message.
+        """
+        # Determines if this is an existing agent, reviving it if it was marked dead
+        is_agent = await self.seen( agent_id );
 
         # Are we not a valid agent? Determine if this is an initialization request!
         if not is_agent:
-            # Extract the callback ID
-            callback_id = bfparser.get_int8();
-
             # You can only send an initialization request if you are not an agent!
             if callback_id != CALLBACK_INIT:
                 # Raise an Exception
                 raise Exception( f'Invalid request from invalid agent {agent_id}' );
 
             # No issues? Dispatch to the respect handler
-            return await self.callback_init( agent_id, bfparser.get_buffer() );
-        elif is_agent and is_alive:
-            # We got a request from a valid agent that is also still marked as alive
-            pass
+            return await self.callback_init( agent_id, fields );
+
+        # We got a request from a valid agent that is alive
+        if callback_id not in self.callbacks:
+            # Raise an Exception
+            raise Exception( f'Invalid request {callback_id} from agent {agent_id}' );
+
+        # Dispatch to the respective handler
+        return await self.callbacks[ callback_id ]( agent_id, fields );
+
+    @metrics.timed( 'callback_parse' )
+    async def parse( self, agent_id : int, message : bytes ):
+        """
+        Parses the incoming message and executes the requested callback.
+        """
+        return await self.dispatch( agent_id, *decode( message ) );
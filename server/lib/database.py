@@ -1,19 +1,50 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
-import os
 import pytz
+import time
 import asyncio
 import datetime
 import calendar
+import contextlib
+import collections
 
 from sqlalchemy.future import select
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import delete, event, func, insert, update
+from sqlalchemy import Column, Index, Integer, String, DateTime, Boolean
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 
+from lib import types
+from lib import metrics
+from lib import liveness
+from lib import scheduler
+
 # Define the "Declarative Base"
 dec_base = declarative_base();
 
+# Event log and agent log write-behind: flush once this many rows are
+# pending, or once the oldest pending row has waited this many seconds.
+LOG_BATCH_SIZE  = 500
+LOG_BATCH_DELAY = 0.05
+
+# Seconds before a batch that failed to write is tried again
+LOG_RETRY_DELAY = 1.0
+
+# Pragmas applied to every SQLite connection: WAL so readers do not block the
+# writer, NORMAL sync ( safe under WAL ), a 64 MB page cache and 256 MB mmap.
+SQLITE_PRAGMAS = [ 'PRAGMA journal_mode = WAL',
+                   'PRAGMA synchronous = NORMAL',
+                   'PRAGMA cache_size = -65536',
+                   'PRAGMA mmap_size = 268435456' ]
+
+# Agent output is stored in rows of at most this many characters, and read
+# back at most this many rows at a time
+AGENT_LOG_ROW_LENGTH = 64 * 1024
+AGENT_LOG_LIMIT      = 1000
+
+# Agents marked dead per UPDATE, within SQLite's bound parameter limit
+AGENT_REAP_BATCH = 500
+
 class EventLog( dec_base ):
     """
     The teamserver 'event log'. Data that the teamserver broadcasts to operators
@@ -21,7 +52,7 @@ class EventLog( dec_base ):
     __tablename__ = 'eventslog'
 
     id      = Column( Integer, primary_key = True, unique = True );
-    ev_time = Column( Integer, nullable = False );
+    ev_time = Column( Integer, nullable = False, index = True );
     ev_type = Column( Integer, nullable = False );
     message = Column( String, nullable = False );
 
@@ -30,6 +61,7 @@ class AgentLog( dec_base ):
     The agent console log. Sort by agent_id for specific agent output
     """
     __tablename__ = 'agentslog'
+    __table_args__ = ( Index( 'ix_agentslog_agent_id', 'agent_id', 'id' ), )
 
     id          = Column( Integer, primary_key = True, unique = True );
     agent_id    = Column( Integer, nullable = False );
@@ -45,7 +77,7 @@ class Agent( dec_base ):
 
     id          = Column( Integer, primary_key = True, unique = True );
     agent_id    = Column( Integer, nullable = False, unique = True );
-    is_alive    = Column( Boolean, nullable = False );
+    is_alive    = Column( Boolean, nullable = False, index = True );
     os_major    = Column( Integer, nullable = False );
     os_minor    = Column( Integer, nullable = False );
     os_build    = Column( Integer, nullable = False );
@@ -54,80 +86,472 @@ class Agent( dec_base ):
     ppid        = Column( Integer, nullable = False );
     process     = Column( String, nullable = False );
 
+class Transaction:
+    """
+    A unit of work spanning several Database calls. Everything written
+    through it commits together when the `async with dbs.transaction()` block
+    exits, and in-memory updates are held back until that commit succeeds.
+
+    @session = AsyncSession() the writes are made through
+    """
+    def __init__( self, session ):
+        # set the session we write through
+        self.session = session
+
+        # callbacks to run once the commit succeeds
+        self.commit_hooks = []
+
+    def on_commit( self, hook, *args ):
+        """
+        Runs hook( *args ) once the transaction has committed.
+        """
+        self.commit_hooks.append( ( hook, args ) );
+
+@metrics.instrument( 'database_' )
 class Database:
     """
     A wrapper around an SQL alchemy database for storing information about
     about agents, agent console interactions and teamserver event log info
     """
-    def __init__( self, ghost ):
+    def __init__( self, ghost, pool_size = 5, max_overflow = 10, bandwidth = 0 ):
         # Set the reference to the Ghost class
         self.ghost = ghost
 
-        # Lock for the list of agents and their queue
-        self.agent_list_lock = asyncio.Lock()
+        # Task queues of the agents keyed by agent_id, and what each is sent
+        # when it polls under the listener's bandwidth in bytes per second
+        self.agent_queues = scheduler.Scheduler( bandwidth );
+
+        # In-memory copy of the agents table keyed by agent_id. Authoritative
+        # for validity / liveness checks so they never have to hit SQLite.
+        self.agent_registry = {}
+
+        # Version of the agents table, bumped on every change, and the
+        # version each agent last changed at ordered oldest change first.
+        # Removed agents keep their entry so diffs can report the removal.
+        self.agent_version = 0
+        self.agent_changes = collections.OrderedDict()
+
+        # When each alive agent was last seen and when it will be considered
+        # dead, and the background task that marks them dead
+        self.agent_liveness = liveness.LivenessTracker();
+        self.agent_reaper = None
+
+        # Event log and agent log rows waiting to be written, and the futures
+        # of callers waiting for those rows to be durable
+        self.event_pending = []
+        self.agent_log_pending = []
+        self.log_waiters = []
+
+        # Last event / agent log id handed out. Ids are assigned here rather
+        # than by SQLite so rows can be pushed to operators before they are
+        # written
+        self.event_last_id = 0
+        self.agent_log_last_id = 0
+
+        # Wakes the log writer when a batch starts, fills or must be flushed
+        self.log_wakeup = asyncio.Event();
+
+        # The background log writer task, and whether it has been asked to stop
+        self.log_writer = None
+        self.log_stopping = False
 
-        # List of the agents their and multiprocessing queue
-        self.agent_list = []
+        # create the async engine with pool_size connections kept open and up to
+        # max_overflow more opened under load
+        self.sql_engine = create_async_engine( 'sqlite+aiosqlite:///ghost-server.db', future = True, pool_size = pool_size, max_overflow = max_overflow );
 
-        # create the async engine
-        self.sql_engine = create_async_engine( 'sqlite+aiosqlite:///ghost-server.db', future = True );
+        # tune every new connection
+        event.listen( self.sql_engine.sync_engine, 'connect', self._on_sql_connect );
 
         # create the async session
         self.sql_session = sessionmaker( bind = self.sql_engine, expire_on_commit = False, class_ = AsyncSession );
 
+    @staticmethod
+    def _on_sql_connect( dbapi_connection, connection_record ):
+        """
+        Applies the SQLITE_PRAGMAS to a freshly opened connection.
+        """
+        cursor = dbapi_connection.cursor();
+
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute( pragma );
+
+        cursor.close();
+
+    @staticmethod
+    def _create_schema( connection ):
+        """
+        Creates any missing tables, then any missing indexes. Databases made
+        before the indexes existed only get them through the second step, as
+        create_all skips tables that are already present.
+        """
+        dec_base.metadata.create_all( connection );
+
+        for table in dec_base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create( connection, checkfirst = True );
+
     async def start( self ):
         """
-        Creates the SQL database if it does not exist
+        Creates the SQL database if it does not exist and migrates an older
+        one to the current schema
         """
-        # Does this path exist and is it a file?
-        if not os.path.exists( './ghost-server.db' ) and not os.path.isfile( './ghost-server.db' ):
-            # It does not or it isnt a file!. Create the database
-            async with self.sql_engine.begin() as engine:
-                # create the database / tables
-                await engine.run_sync( dec_base.metadata.create_all );
+        async with self.sql_engine.begin() as engine:
+            # create / migrate the database tables and indexes
+            await engine.run_sync( self._create_schema );
 
         # Establish a session to the DB now
         async with self.sql_session() as session:
             # Start the session
             async with session.begin():
-                # Perform the query to query all the agents that are marked as alive in the DB
-                sql_result = await session.execute( select( Agent ).where( Agent.is_alive == True ) );
+                # Perform the query to query all the agents in the DB
+                sql_result = await session.execute( select( Agent ) );
+
+                # Alive agents get a full timeout from now to call back in
+                now = time.time();
 
                 # Loop through each SQL entry
                 for sql_entry in sql_result.scalars().all():
-                    # Add the entry to the list of valid agents with its new queue!
-                    self.agent_list.append( { 'id': sql_entry.agent_id, 'queue': asyncio.Queue() } );
+                    # Load the entry into the agent registry
+                    self._agent_registry_set( sql_entry );
+
+                    # Is this agent still marked as alive?
+                    if sql_entry.is_alive:
+                        # Add the entry to the table of valid agents with its new queue!
+                        self._agent_queue_create( sql_entry.agent_id );
+
+                        # Start watching it. We have not heard from it yet
+                        self.agent_liveness.watch( sql_entry.agent_id, now );
+
+                # Continue numbering events from the last one written
+                self.event_last_id = ( await session.execute( select( func.max( EventLog.id ) ) ) ).scalar() or 0
+                self.agent_log_last_id = ( await session.execute( select( func.max( AgentLog.id ) ) ) ).scalar() or 0
+
+        # Start the write-behind log writer
+        self.log_writer = asyncio.create_task( self._log_writer() );
 
-    async def database_event_add( self, ev_type, ev_msg ):
+        # Start marking agents that stop calling back as dead
+        self.agent_reaper = asyncio.create_task( self._agent_reaper() );
+
+    async def stop( self ):
         """
-        Adds an event to the log.
+        Stops the reaper and log writer and flushes any rows that are still
+        pending.
+        """
+        # Stop the reaper
+        if self.agent_reaper is not None:
+            self.agent_reaper.cancel();
+
+            try:
+                await self.agent_reaper
+            except asyncio.CancelledError:
+                pass
+
+            self.agent_reaper = None
+
+        # Let the writer finish the batch it is on so it cannot race the
+        # final flush. Cancelling it could lose a batch mid-insert
+        if self.log_writer is not None:
+            self.log_stopping = True
+            self.log_wakeup.set();
+
+            await self.log_writer
+
+            self.log_writer = None
+
+        try:
+            # Write out whatever is left
+            await self._log_flush();
+        finally:
+            # Close the connection pool
+            await self.sql_engine.dispose();
+
+    async def _log_writer( self ):
+        """
+        Writes pending log rows in batches, either once the batch is full or
+        once the first row in it has waited LOG_BATCH_DELAY seconds.
+        """
+        while not self.log_stopping:
+            # Wait for the first row of a batch
+            await self.log_wakeup.wait();
+            self.log_wakeup.clear();
+
+            # Give the batch time to fill unless it is full, someone is waiting on it or we are stopping
+            if self._log_pending() < LOG_BATCH_SIZE and not self.log_waiters and not self.log_stopping:
+                try:
+                    await asyncio.wait_for( self.log_wakeup.wait(), LOG_BATCH_DELAY );
+                except asyncio.TimeoutError:
+                    pass
+
+                self.log_wakeup.clear();
+
+            try:
+                # Write the batch out
+                await self._log_flush();
+            except Exception as exception:
+                # Keep the writer alive, the callers awaiting the batch get the error
+                if self.ghost is not None:
+                    self.ghost.log.error( f'Failed to write the logs: {exception}' );
+
+                # The rows were put back, so try them again shortly
+                if not self.log_stopping:
+                    await asyncio.sleep( LOG_RETRY_DELAY );
+                    self.log_wakeup.set();
+
+    async def _log_flush( self ):
+        """
+        Writes every pending event and agent log row in one multi-row insert
+        per table and resolves the callers that were waiting for them.
+        """
+        # Take ownership of the current batch
+        event_rows, self.event_pending = self.event_pending, []
+        agent_rows, self.agent_log_pending = self.agent_log_pending, []
+        event_wait, self.log_waiters = self.log_waiters, []
+
+        try:
+            if event_rows or agent_rows:
+                # Creates an SQL "session"
+                async with self.sql_session() as session:
+                    # Start the session
+                    async with session.begin():
+                        # Insert the whole batch at once
+                        if event_rows:
+                            await session.execute( insert( EventLog ), event_rows );
+
+                        if agent_rows:
+                            await session.execute( insert( AgentLog ), agent_rows );
+
+                # Count what was written
+                metrics.count( 'database_event_rows', len( event_rows ) );
+                metrics.count( 'database_agent_log_rows', len( agent_rows ) );
+        except asyncio.CancelledError:
+            # Put the batch and its waiters back for the next flush
+            self.event_pending[ 0 : 0 ] = event_rows
+            self.agent_log_pending[ 0 : 0 ] = agent_rows
+            self.log_waiters[ 0 : 0 ] = event_wait
+            raise
+        except Exception as exception:
+            # Put the batch back for the next flush. Its ids were already
+            # pushed to operators, so it must not be dropped
+            self.event_pending[ 0 : 0 ] = event_rows
+            self.agent_log_pending[ 0 : 0 ] = agent_rows
+
+            # Let anyone waiting on durability know it failed
+            for waiter in event_wait:
+                if not waiter.done():
+                    waiter.set_exception( exception );
+            raise
+
+        # Release anyone waiting on durability
+        for waiter in event_wait:
+            if not waiter.done():
+                waiter.set_result( None );
+
+    @contextlib.asynccontextmanager
+    async def transaction( self ):
+        """
+        Opens a unit of work. Pass the yielded Transaction as tx to the
+        database_* methods to have them commit together.
+        """
+        # Creates an SQL "session"
+        async with self.sql_session() as session:
+            tx = Transaction( session );
+
+            # Start the session, committing when the block exits
+            async with session.begin():
+                yield tx
+
+        # Committed! Apply the in-memory updates
+        for hook, args in tx.commit_hooks:
+            hook( *args );
+
+    @contextlib.asynccontextmanager
+    async def _transaction( self, tx ):
+        """
+        Joins the callers unit of work if there is one, otherwise opens one
+        just for this call.
+        """
+        if tx is not None:
+            yield tx
+        else:
+            async with self.transaction() as tx:
+                yield tx
+
+    def _agent_queue_create( self, agent_id ):
+        """
+        Creates the task queue entry for the agent if it does not exist yet.
+        """
+        self.agent_queues.create( agent_id );
+
+    def _outbound_drop( self, agent_id ):
+        """
+        Drops the message the listener was sending to the agent.
+        """
+        sck = getattr( self.ghost, 'sck', None );
+
+        if sck is not None:
+            sck.outbound_drop( agent_id );
+
+    def _notify( self, method, argument, item ):
+        """
+        Pushes the item to the connected operators through the RPC server.
+        """
+        if self.ghost is not None:
+            self.ghost.rpc.rpc_notify( method, argument, item );
+
+    def _agent_changed( self, agent_id ):
+        """
+        Bumps the agents table version and records it against the agent.
+        """
+        self.agent_version += 1
+
+        # Move the agent to the newest end of the changes
+        self.agent_changes[ agent_id ] = self.agent_version
+        self.agent_changes.move_to_end( agent_id );
+
+    def _agent_registry_set( self, agent ):
+        """
+        Stores or replaces the registry entry for the agent row.
+        """
+        self._agent_changed( agent.agent_id );
+
+        self.agent_registry[ agent.agent_id ] = { 'is_alive': agent.is_alive,
+                                                  'os_major': agent.os_major,
+                                                  'os_minor': agent.os_minor,
+                                                  'os_build': agent.os_build,
+                                                  'pid': agent.pid,
+                                                  'ppid': agent.ppid,
+                                                  'process': agent.process };
+
+    def _log_pending( self ):
+        """
+        Returns how many log rows are waiting to be written.
+        """
+        return len( self.event_pending ) + len( self.agent_log_pending );
+
+    def _log_queued( self ):
+        """
+        Wakes the writer when a batch starts or fills up.
+        """
+        if self._log_pending() == 1 or self._log_pending() >= LOG_BATCH_SIZE:
+            self.log_wakeup.set();
+
+    def _event_queue( self, ev_type, ev_msg ):
+        """
+        Numbers the event, queues it for the writer and pushes it out.
+        """
+        # Number the 'event'
+        self.event_last_id += 1
+
+        # Queue the 'event'
+        self.event_pending.append( { 'id': self.event_last_id, 'ev_time': calendar.timegm( datetime.datetime.now( tz = pytz.UTC ).utctimetuple() ), 'ev_type': ev_type, 'message': ev_msg } );
+
+        # Push it to the operators straight away
+        self._notify( 'teamserver_event_log_push', 'events', { 'id': self.event_last_id, 'timestamp': self.event_pending[ -1 ][ 'ev_time' ], 'type': ev_type, 'message': ev_msg } );
+
+        # Let the writer know
+        self._log_queued();
+
+    async def database_event_add( self, ev_type, ev_msg, durable = False, tx = None ):
+        """
+        Adds an event to the log. The event is written in the background with
+        the rest of its batch; pass durable = True to wait until it has been
+        committed. Inside a transaction the event is only logged once the
+        transaction commits, and durable is ignored.
+        """
+        # Part of a unit of work? Log it if and when it commits
+        if tx is not None:
+            tx.on_commit( self._event_queue, ev_type, ev_msg );
+            return
+
+        # Queue the 'event'
+        self._event_queue( ev_type, ev_msg );
+
+        # Wait for it to hit the disk?
+        if durable:
+            await self.database_log_flush();
+
+    async def database_log_flush( self ):
+        """
+        Waits until every event and agent log row added so far has been
+        committed.
+        """
+        # No writer running? Flush it ourselves
+        if self.log_writer is None:
+            return await self._log_flush();
+
+        # Register to be told when the next batch commits
+        waiter = asyncio.get_running_loop().create_future();
+        self.log_waiters.append( waiter );
+
+        # Ask the writer to flush now rather than waiting out the delay
+        self.log_wakeup.set();
+
+        # Wait for the commit
+        await waiter
+
+    async def database_event_get_queue( self, log_offset, last_id = None ):
+        """
+        Returns up to 1000 events in id order. When last_id is given only
+        events after that id are returned ( keyset ), otherwise events at and
+        past the log offset are returned.
         """
         # Creates an SQL "session"
         async with self.sql_session() as session:
             # Start the session
             async with session.begin():
-                # Create an 'event'
-                event = EventLog( ev_time = calendar.timegm( datetime.datetime.now( tz = pytz.UTC ).utctimetuple() ), ev_type = ev_type, message = ev_msg );
+                if last_id is not None:
+                    # Seek straight past the last event the caller has seen
+                    sql_result = await session.execute( select( EventLog ).where( EventLog.id > last_id ).order_by( EventLog.id ).limit( 1000 ) );
+                else:
+                    # Look for any events that are at or past the log offset
+                    sql_result = await session.execute( select( EventLog ).order_by( EventLog.id ).offset( log_offset ).limit( 1000 ) );
+
+                # Return the unfiltered results!
+                return sql_result.scalars().all()
+
+    def _agent_log_queue( self, agent_id, log_type, log_message ):
+        """
+        Numbers the agent log row, queues it for the writer and tells the
+        operators how far the agent's log now goes.
+        """
+        # Number the row
+        self.agent_log_last_id += 1
 
-                # Add to the database
-                session.add( event );
+        # Queue the row
+        self.agent_log_pending.append( { 'id': self.agent_log_last_id, 'agent_id': agent_id, 'log_time': calendar.timegm( datetime.datetime.now( tz = pytz.UTC ).utctimetuple() ), 'log_type': log_type, 'log_message': log_message } );
 
-                # Commit it!
-                await session.commit()
+        # Push the new cursor rather than the output, consoles pull what they need
+        self._notify( 'teamserver_agent_log_push', 'cursors', [ agent_id, self.agent_log_last_id ] );
 
-                # Flush the results
-                await session.flush()
+        # Let the writer know
+        self._log_queued();
 
-    async def database_event_get_queue( self, log_offset ):
+    async def database_agent_log_add( self, agent_id, log_type, log_message, tx = None ):
+        """
+        Appends output to the agent's console log, split into rows of at most
+        AGENT_LOG_ROW_LENGTH characters. Written in the background with the
+        rest of its batch; inside a transaction it is only appended once the
+        transaction commits.
         """
-        Returns all events queued at and past the log offset
+        # Loop through each row of the output
+        for offset in range( 0, max( len( log_message ), 1 ), AGENT_LOG_ROW_LENGTH ):
+            # Part of a unit of work? Append it if and when it commits
+            if tx is not None:
+                tx.on_commit( self._agent_log_queue, agent_id, log_type, log_message[ offset : offset + AGENT_LOG_ROW_LENGTH ] );
+            else:
+                self._agent_log_queue( agent_id, log_type, log_message[ offset : offset + AGENT_LOG_ROW_LENGTH ] );
+
+    async def database_agent_log_get( self, agent_id, after_id = 0, limit = AGENT_LOG_LIMIT ):
+        """
+        Returns up to limit ( at most AGENT_LOG_LIMIT ) rows of the agent's
+        console log after after_id, in id order.
         """
         # Creates an SQL "session"
         async with self.sql_session() as session:
             # Start the session
             async with session.begin():
-                # Look for any events that are at or past the log offset
-                sql_result = await session.execute( select( EventLog ).offset( log_offset ).limit( 1000 ) );
+                # Seek straight past the last row the caller has seen on ( agent_id, id )
+                sql_result = await session.execute( select( AgentLog ).where( AgentLog.agent_id == agent_id, AgentLog.id > after_id ).order_by( AgentLog.id ).limit( max( 1, min( limit, AGENT_LOG_LIMIT ) ) ) );
 
                 # Return the unfiltered results!
                 return sql_result.scalars().all()
@@ -146,91 +570,234 @@ class Database:
                 # Return the unfiletered results!
                 return sql_result.scalars().all()
 
+    async def database_agent_get_diff( self, since_version ):
+        """
+        Returns the current agents table version, the agents added or changed
+        after since_version and the ids of agents removed after it. A version
+        newer than the table ( the teamserver restarted ) returns everything.
+        """
+        agent_updated = []
+        agent_removed = []
+
+        # A version from before a restart means nothing, start over
+        if since_version > self.agent_version:
+            since_version = 0
+
+        # Walk back from the newest change until we reach since_version
+        for agent_id, version in reversed( self.agent_changes.items() ):
+            if version <= since_version:
+                break
+
+            if agent_id in self.agent_registry:
+                agent_updated.append( { 'id': agent_id, **self.agent_registry[ agent_id ] } );
+            else:
+                agent_removed.append( agent_id );
+
+        # Return the version and the changes, oldest change first
+        return self.agent_version, agent_updated[ ::-1 ], agent_removed[ ::-1 ]
+
     async def database_agent_is_alive( self, agent_id ):
         """
         Returns whether or not the agent is alive.
         """
-        # Creates an SQL "session"
-        async with self.sql_session() as session:
-            # Start the session
-            async with session.begin():
-                # Select within the table where it matches the specified agent_id
-                sql_result = await session.execute( select( Agent ).where( Agent.agent_id == agent_id ) );
+        # Lookup the agent in the registry
+        agent = self.agent_registry.get( agent_id );
 
-                # Return whether or not it is alive
-                return sql_result.scalar().is_alive
+        # Return whether or not it is alive
+        return agent is not None and agent[ 'is_alive' ]
 
     async def database_agent_is_valid( self, agent_id ):
         """
         Returns whether or not the agent is valid
         """
-        # Creates an SQL "session"
-        async with self.sql_session() as session:
-            # Start the session
-            async with session.begin():
-                # Select within the table where it matches the specified agent_id
-                sql_result = await session.execute( select( Agent ).where( Agent.agent_id == agent_id ) );
+        # Returns whether or not an entry exists
+        return agent_id in self.agent_registry
+
+    def _agent_added( self, agent ):
+        """
+        Writes a newly inserted agent through to the registry and table.
+        """
+        # Write through to the registry
+        self._agent_registry_set( agent );
+
+        # Add the agent to the table!
+        self._agent_queue_create( agent.agent_id );
+
+        # Start watching it, the check-in itself is recorded by the callback
+        self.agent_liveness.watch( agent.agent_id, time.time() );
+
+        # Let the operators know about it
+        self._notify( 'teamserver_agent_list_push', 'versions', self.agent_version );
+
+    def _agent_removed( self, agent_id ):
+        """
+        Drops a deleted agent from the registry and table.
+        """
+        # Drop it from the registry and table
+        self.agent_registry.pop( agent_id, None );
+        self.agent_queues.remove( agent_id );
+        self.agent_liveness.forget( agent_id );
+        self._outbound_drop( agent_id );
+
+        # Record the removal
+        self._agent_changed( agent_id );
+
+        # Let the operators know about it
+        self._notify( 'teamserver_agent_list_push', 'versions', self.agent_version );
+
+    def _agent_alive_set( self, agent_id, is_alive ):
+        """
+        Writes a liveness change through to the registry and table.
+        """
+        # Write through to the registry
+        if agent_id in self.agent_registry:
+            self.agent_registry[ agent_id ][ 'is_alive' ] = is_alive
+            self._agent_changed( agent_id );
+
+            # Let the operators know about it
+            self._notify( 'teamserver_agent_list_push', 'versions', self.agent_version );
+
+        if is_alive:
+            # A revived agent needs somewhere to receive tasks again
+            self._agent_queue_create( agent_id );
+            self.agent_liveness.watch( agent_id, time.time() );
+        else:
+            # Stop watching a dead agent, and keep its queue only if tasks are waiting
+            self.agent_liveness.forget( agent_id );
+            self.agent_queues.remove_idle( agent_id );
+
+    def _agents_reaped( self, agent_ids ):
+        """
+        Writes agents marked dead by the reaper through to the registry and
+        table.
+        """
+        for agent_id in agent_ids:
+            if agent_id in self.agent_registry:
+                self.agent_registry[ agent_id ][ 'is_alive' ] = False
+                self._agent_changed( agent_id );
 
-                # Returns whether or not an entry exists
-                return sql_result.scalar() is not None
+            # Keep its queue only if tasks are waiting, but not the message
+            # it was part way through receiving
+            self.agent_queues.remove_idle( agent_id );
+            self._outbound_drop( agent_id );
 
-    async def database_agent_add( self, agent_id, os_major, os_minor, os_build, pid, ppid, process ):
+        # Count them
+        metrics.count( 'database_agents_reaped', len( agent_ids ) );
+
+        # Let the operators know about them, once
+        self._notify( 'teamserver_agent_list_push', 'versions', self.agent_version );
+
+    async def _agent_reaper( self ):
+        """
+        Marks the agents that have stopped calling back as dead every tick.
+        """
+        while True:
+            await asyncio.sleep( liveness.LIVENESS_TICK );
+
+            # Which agents ran out of time?
+            agent_ids = [ agent_id for agent_id in self.agent_liveness.expire( time.time() ) if self.agent_registry.get( agent_id, {} ).get( 'is_alive' ) ];
+
+            if not agent_ids:
+                continue
+
+            try:
+                # Mark them all dead at once
+                await self.database_agent_reap( agent_ids );
+            except Exception as exception:
+                # Try them again shortly
+                for agent_id in agent_ids:
+                    self.agent_liveness.watch( agent_id, time.time(), liveness.LIVENESS_TICK );
+
+                if self.ghost is not None:
+                    self.ghost.log.error( f'Failed to mark agents as dead: {exception}' );
+
+    async def database_agent_add( self, agent_id, os_major, os_minor, os_build, pid, ppid, process, tx = None ):
         """
         Adds an agent to the database and active agent list
         """
-        # Acquire a lock on the list
-        async with self.agent_list_lock:
-            # Creates an SQL "session"
-            async with self.sql_session() as session:
-                # Start the session
-                async with session.begin():
-                    # Create the row entry
-                    agent = Agent( agent_id = agent_id, is_alive = True, os_major = os_major, os_minor = os_minor, os_build = os_build, pid = pid, ppid = ppid, process = process );
+        # Join or open a unit of work
+        async with self._transaction( tx ) as tx:
+            # Create the row entry
+            agent = Agent( agent_id = agent_id, is_alive = True, os_major = os_major, os_minor = os_minor, os_build = os_build, pid = pid, ppid = ppid, process = process );
 
-                    # add the entry to the table
-                    session.add( agent );
+            # add the entry to the table
+            tx.session.add( agent );
 
-                    # commit the entry to the table
-                    await session.commit();
+            # Write through once it is committed
+            tx.on_commit( self._agent_added, agent );
 
-                    # flush the cache
-                    await session.flush();
+    async def database_agent_remove( self, agent_id, tx = None ):
+        """
+        Removes the agent from the database, registry and active agent list.
+        """
+        # Join or open a unit of work
+        async with self._transaction( tx ) as tx:
+            # Delete the agent entry that matches the specified agent_id
+            await tx.session.execute( delete( Agent ).where( Agent.agent_id == agent_id ) );
 
-            # Add the agent to the list!
-            self.agent_list.append( { 'id': agent_id, 'queue': asyncio.Queue() } );
+            # Write through once it is committed
+            tx.on_commit( self._agent_removed, agent_id );
 
-    async def database_agent_add_queue( self, agent_id, message ):
+    async def database_agent_set_alive( self, agent_id, is_alive, tx = None ):
         """
-        Adds the message to the queue for the agent.
+        Marks the agent as alive or dead in the database and registry.
         """
-        # Acquire a lock on the list
-        async with self.agent_list_lock:
-            # Attempt to pull the queue
-            agent_queue = [ agent[ 'queue' ] for agent in self.agent_list if agent[ 'id' ] == agent_id ][ 0 ]
+        # Join or open a unit of work
+        async with self._transaction( tx ) as tx:
+            # Update the agent entry that matches the specified agent_id
+            await tx.session.execute( update( Agent ).where( Agent.agent_id == agent_id ).values( is_alive = is_alive ) );
 
-            # Add to the queue
-            await agent_queue.put( message );
+            # Write through once it is committed
+            tx.on_commit( self._agent_alive_set, agent_id, is_alive );
 
-    async def database_agent_get_queue( self, agent_id ):
+    async def database_agent_reap( self, agent_ids, tx = None ):
         """
-        Empties the queue for the specific agent.
+        Marks the agents as dead in batched UPDATEs and logs that they stopped
+        responding.
         """
-        # Acquire a lock on the list
-        async with self.agent_list_lock:
+        # Join or open a unit of work
+        async with self._transaction( tx ) as tx:
+            # One UPDATE per batch of agents
+            for offset in range( 0, len( agent_ids ), AGENT_REAP_BATCH ):
+                await tx.session.execute( update( Agent ).where( Agent.agent_id.in_( agent_ids[ offset : offset + AGENT_REAP_BATCH ] ) ).values( is_alive = False ) );
 
-            # Return buffer
-            return_buff = b''
+            # Print that we lost them
+            for agent_id in agent_ids:
+                await self.database_event_add( types.EventLogType.ERROR, f'Agent stopped responding -> ID: {agent_id}', tx = tx );
 
-            # Attempt to pull the queue
-            agent_queue = [ agent[ 'queue' ] for agent in self.agent_list if agent[ 'id' ] == agent_id ][ 0 ]
+            # Write through once it is committed
+            tx.on_commit( self._agents_reaped, agent_ids );
 
-            # While we are not a 
-            while agent_queue.qsize() != 0:
-                # Add to the return buffer!
-                return_buff += await agent_queue.get()
+    async def database_agent_seen( self, agent_id, sleep = None, jitter = None, kill_date = None ):
+        """
+        Records contact from an alive agent, optionally with the callback
+        timing it was configured with: sleep in milliseconds, jitter as a
+        percentage and kill_date in epoch seconds.
+        """
+        if self.agent_registry.get( agent_id, {} ).get( 'is_alive' ):
+            self.agent_liveness.seen( agent_id, time.time(), sleep, jitter, kill_date );
+
+    async def database_agent_add_queue( self, agent_id, message, priority = types.TaskPriority.NORMAL ):
+        """
+        Adds the message to the queue for the agent at the specified priority.
+        Raises an Exception if the agent has no queue, as it is unknown or
+        dead, or its queue is over its quota.
+        """
+        self.agent_queues.add( agent_id, message, priority );
 
-            # Return the byts buffer
-            return return_buff
+    async def database_agent_get_queue( self, agent_id, max_length = None ):
+        """
+        Takes the agent's next messages, highest priority first, as far as its
+        share of the listener's bandwidth allows. If max_length is set, only
+        as many whole messages as fit in max_length bytes are returned and the
+        remainder stays queued for the next poll. A single message larger than
+        max_length is still returned on its own so it cannot block the queue.
+        """
+        return self.agent_queues.take( agent_id, max_length );
 
-        # Return nothing?
-        return ''
+    async def database_agent_get_queue_stats( self ):
+        """
+        Returns the queue depth, bytes and wait times of each agent that has
+        had tasks queued.
+        """
+        return self.agent_queues.stats()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# Seconds per slot of the timing wheel and how many slots it has. Deadlines
+# further out than one turn of the wheel wait in their slot for later turns.
+LIVENESS_TICK  = 1.0
+LIVENESS_SLOTS = 4096
+
+# Callbacks an agent may miss before it is considered dead, and the least
+# time that is ever allowed
+LIVENESS_MISSED      = 3
+LIVENESS_MIN_TIMEOUT = 60
+
+# How long an agent with no known or learned callback interval is given
+LIVENESS_DEFAULT_TIMEOUT = 3600
+
+class TimingWheel:
+    """
+    A hashed timing wheel of deadlines keyed by any hashable. Scheduling and
+    cancelling are O(1), and advancing only visits the slots for the ticks
+    that passed, so finding what expired costs the expired entries plus the
+    few in those slots waiting on a later turn, never a scan of everything.
+    """
+    def __init__( self, tick = LIVENESS_TICK, slots = LIVENESS_SLOTS ):
+        # set the wheel geometry
+        self.tick = tick
+        self.slots = [ set() for _ in range( slots ) ];
+
+        # deadline of every scheduled key
+        self.deadlines = {}
+
+        # the tick the wheel has advanced to, set on first use
+        self.current = None
+
+    def __len__( self ):
+        return len( self.deadlines );
+
+    def _slot( self, deadline ):
+        """
+        Returns the slot the deadline falls in.
+        """
+        return self.slots[ int( deadline // self.tick ) % len( self.slots ) ]
+
+    def schedule( self, key, deadline ):
+        """
+        Schedules the key to expire at deadline, replacing its old deadline.
+        """
+        self.cancel( key );
+
+        # Never schedule into a tick the wheel has already passed
+        if self.current is not None:
+            deadline = max( deadline, self.current * self.tick );
+
+        self.deadlines[ key ] = deadline
+        self._slot( deadline ).add( key );
+
+    def cancel( self, key ):
+        """
+        Unschedules the key if it is scheduled.
+        """
+        deadline = self.deadlines.pop( key, None );
+
+        if deadline is not None:
+            self._slot( deadline ).discard( key );
+
+    def advance( self, now ):
+        """
+        Turns the wheel up to now and returns the keys that expired.
+        """
+        target = int( now // self.tick );
+        expired = []
+
+        # First turn? Nothing can be behind us yet
+        if self.current is None:
+            self.current = target
+
+        # Visit each slot we pass, at most one full turn's worth
+        for tick in range( max( self.current, target - len( self.slots ) + 1 ), target + 1 ):
+            slot = self.slots[ tick % len( self.slots ) ]
+
+            for key in [ key for key in slot if self.deadlines[ key ] <= now ]:
+                slot.discard( key );
+                del self.deadlines[ key ]
+                expired.append( key );
+
+        self.current = target
+
+        return expired
+
+class LivenessEntry:
+    """
+    What the tracker knows about one agent's callbacks.
+    """
+    __slots__ = ( 'first_seen', 'last_seen', 'interval', 'kill_date', 'declared' )
+
+    def __init__( self ):
+        # the first and latest real callbacks, None until there has been one
+        self.first_seen = None
+        self.last_seen = None
+
+        # the callback interval in seconds, whether the agent declared it
+        # rather than us learning it, and its kill date
+        self.interval = None
+        self.declared = False
+        self.kill_date = None
+
+    def trusted( self ):
+        """
+        Returns whether the interval can be relied on: the agent declared it,
+        or its callbacks have been watched for long enough that the longest
+        gap between them is a real sleep and not a burst within one callback.
+        """
+        return self.declared or ( self.interval is not None and self.last_seen - self.first_seen >= LIVENESS_MIN_TIMEOUT )
+
+class LivenessTracker:
+    """
+    Tracks when each agent was last seen and when it should be considered
+    dead: after LIVENESS_MISSED callback intervals, or at its kill date if
+    that is sooner. The interval is the one the agent declared ( sleep plus
+    jitter ) or, failing that, the longest gap seen between two of its real
+    callbacks. Until either is known the agent gets LIVENESS_DEFAULT_TIMEOUT.
+    """
+    def __init__( self ):
+        # the deadlines
+        self.wheel = TimingWheel();
+
+        # what we know about each agent keyed by agent_id
+        self.agents = {}
+
+    def _schedule( self, agent_id, entry, now ):
+        """
+        Schedules the agent's deadline from now.
+        """
+        deadline = now + ( max( LIVENESS_MIN_TIMEOUT, entry.interval * LIVENESS_MISSED ) if entry.trusted() else LIVENESS_DEFAULT_TIMEOUT );
+
+        if entry.kill_date:
+            deadline = min( deadline, entry.kill_date );
+
+        self.wheel.schedule( agent_id, deadline );
+
+    def watch( self, agent_id, now, timeout = LIVENESS_DEFAULT_TIMEOUT ):
+        """
+        Starts tracking an agent without having heard from it, such as every
+        agent loaded at startup, giving it timeout seconds from now. Nothing
+        is learned from this; agents already tracked are left alone.
+        """
+        if agent_id not in self.agents:
+            self.agents[ agent_id ] = LivenessEntry();
+            self.wheel.schedule( agent_id, now + timeout );
+
+    def seen( self, agent_id, now, sleep = None, jitter = None, kill_date = None ):
+        """
+        Records a real callback from the agent at now ( epoch seconds ). sleep
+        is in milliseconds and jitter a percentage, as in the payload
+        configuration.
+        """
+        entry = self.agents.get( agent_id );
+
+        if entry is None:
+            entry = self.agents[ agent_id ] = LivenessEntry();
+
+        if entry.last_seen is None:
+            # The first real callback, nothing to learn yet
+            entry.first_seen = now
+        elif not entry.declared and now - entry.last_seen > ( entry.interval or 0 ):
+            # Learn the longest gap between callbacks
+            entry.interval = now - entry.last_seen
+
+        entry.last_seen = now
+
+        # Did the agent tell us its timing?
+        if sleep:
+            entry.interval = sleep / 1000 * ( 1 + ( jitter or 0 ) / 100 );
+            entry.declared = True
+
+        if kill_date:
+            entry.kill_date = kill_date
+
+        # When will it be dead?
+        self._schedule( agent_id, entry, now );
+
+    def forget( self, agent_id ):
+        """
+        Stops tracking the agent.
+        """
+        self.agents.pop( agent_id, None );
+        self.wheel.cancel( agent_id );
+
+    def expire( self, now ):
+        """
+        Returns the agents whose deadline passed by now and stops tracking
+        them.
+        """
+        expired = self.wheel.advance( now );
+
+        for agent_id in expired:
+            self.agents.pop( agent_id, None );
+
+        return expired
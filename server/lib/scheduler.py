@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import time
+import collections
+
+from lib import types
+from lib import metrics
+
+# Seconds per deficit round robin round
+SCHEDULER_ROUND = 0.1
+
+# Rounds of unspent share an agent may save up, so one that polls rarely
+# cannot burst through the budget when it does
+SCHEDULER_BURST_ROUNDS = 10
+
+# Bytes that may be queued to a single agent
+SCHEDULER_AGENT_QUOTA = 64 * 1024 * 1024
+
+class AgentQueue:
+    """
+    The tasks queued to one agent, one FIFO per priority, along with its
+    deficit round robin state and wait statistics.
+    """
+    __slots__ = ( 'queues', 'size', 'deficit', 'round', 'taken', 'waited' )
+
+    def __init__( self ):
+        # ( message, time queued ) per priority, highest first
+        self.queues = [ collections.deque() for _ in types.TaskPriority ]
+
+        # bytes queued
+        self.size = 0
+
+        # bytes the agent may still be sent, and the round it was last topped up
+        self.deficit = 0
+        self.round = 0
+
+        # messages taken and the seconds they spent queued
+        self.taken = 0
+        self.waited = 0.0
+
+    def head( self ):
+        """
+        Returns the queue the next message comes from, or None if empty.
+        """
+        for queue in self.queues:
+            if queue:
+                return queue
+
+        return None
+
+class Scheduler:
+    """
+    Decides what each agent is sent when it polls. Tasks go out in priority
+    order, each agent may only have so many bytes queued, and when the
+    listener has a bandwidth budget it is shared between the agents with
+    queued tasks by deficit round robin: every round each of them is owed an
+    equal share, and a task is only sent once the agent is owed its size. A
+    large upload to one agent then trickles out at its share instead of
+    holding up everyone else's commands.
+    """
+    def __init__( self, bandwidth = 0 ):
+        # bytes per second shared between the agents, or 0 for no limit
+        self.bandwidth = bandwidth
+
+        # the queues keyed by agent_id
+        self.agents = {}
+
+        # how many agents have tasks queued
+        self.backlogged = 0
+
+        # how long tasks spend queued
+        self.wait_record = metrics.histogram( 'scheduler_wait' );
+
+    def __contains__( self, agent_id ):
+        return agent_id in self.agents
+
+    def __len__( self ):
+        return len( self.agents );
+
+    def create( self, agent_id ):
+        """
+        Creates the queue for the agent if it does not exist yet.
+        """
+        if agent_id not in self.agents:
+            self.agents[ agent_id ] = AgentQueue();
+
+    def remove( self, agent_id ):
+        """
+        Drops the agent's queue along with any tasks in it.
+        """
+        agent = self.agents.pop( agent_id, None );
+
+        if agent is not None and agent.size:
+            self.backlogged -= 1
+
+    def remove_idle( self, agent_id ):
+        """
+        Drops the agent's queue if nothing is waiting in it.
+        """
+        agent = self.agents.get( agent_id );
+
+        if agent is not None and not agent.size:
+            del self.agents[ agent_id ]
+
+    def add( self, agent_id, message, priority = types.TaskPriority.NORMAL ):
+        """
+        Queues the message to the agent at the specified priority. Raises an
+        Exception if the agent has no queue or it is over its quota.
+        """
+        agent = self.agents.get( agent_id );
+
+        # Not an agent we are taking tasks for?
+        if agent is None:
+            raise Exception( f'No task queue for agent {agent_id}' );
+
+        # Over its quota?
+        if agent.size + len( message ) > SCHEDULER_AGENT_QUOTA:
+            raise Exception( f'Task queue for agent {agent_id} is over its {SCHEDULER_AGENT_QUOTA} byte quota' );
+
+        # Starting a backlog? It is owed nothing for the time it was idle
+        if not agent.size:
+            self.backlogged += 1
+            agent.deficit = 0
+            agent.round = int( time.monotonic() / SCHEDULER_ROUND );
+
+        agent.queues[ priority ].append( ( message, time.monotonic() ) );
+        agent.size += len( message );
+
+    def take( self, agent_id, max_length = None ):
+        """
+        Takes the agent's next tasks, highest priority first, and returns them
+        joined. If max_length is set, only as many whole messages as fit in
+        max_length bytes are taken, though a single larger message is still
+        taken on its own so it cannot block the queue. Returns nothing until
+        the agent is owed the size of its next message.
+        """
+        agent = self.agents[ agent_id ]
+        queue = agent.head();
+
+        if queue is None:
+            return b''
+
+        now = time.monotonic();
+
+        if self.bandwidth:
+            # Top up the share owed for the rounds since we last looked
+            current = int( now / SCHEDULER_ROUND );
+            quantum = self.bandwidth * SCHEDULER_ROUND / self.backlogged
+
+            agent.deficit = min( agent.deficit + quantum * ( current - agent.round ), max( quantum * SCHEDULER_BURST_ROUNDS, len( queue[ 0 ][ 0 ] ) ) );
+            agent.round = current
+
+            budget = agent.deficit
+        else:
+            budget = float( 'inf' );
+
+        # Messages to join into the return buffer
+        return_list = []
+        return_size = 0
+
+        while queue is not None:
+            size = len( queue[ 0 ][ 0 ] );
+
+            # Not owed enough yet, or would it overflow max_length?
+            if return_size + size > budget or ( max_length is not None and return_list and return_size + size > max_length ):
+                break
+
+            # Take it, and note how long it waited
+            message, queued = queue.popleft();
+            wait = now - queued
+
+            return_list.append( message );
+            return_size += size
+
+            agent.taken += 1
+            agent.waited += wait
+            self.wait_record.observe( wait );
+
+            queue = agent.head();
+
+        # Charge it to the agent
+        agent.size -= return_size
+
+        if self.bandwidth:
+            agent.deficit -= return_size
+
+        # Emptied? Like any idle agent it is owed nothing
+        if return_size and not agent.size:
+            self.backlogged -= 1
+            agent.deficit = 0
+
+        return b''.join( return_list );
+
+    def stats( self ):
+        """
+        Returns, for each agent that has had tasks queued, its queue depth per
+        priority, bytes queued and owed, how long the oldest task has waited
+        and the mean wait of the tasks taken so far.
+        """
+        now = time.monotonic();
+        stats = []
+
+        for agent_id, agent in self.agents.items():
+            if not agent.size and not agent.taken:
+                continue
+
+            # When was the oldest task still queued?
+            oldest = min( ( queue[ 0 ][ 1 ] for queue in agent.queues if queue ), default = now );
+
+            stats.append( { 'agent_id': agent_id,
+                            'depths': [ len( queue ) for queue in agent.queues ],
+                            'bytes': agent.size,
+                            'deficit': int( agent.deficit ),
+                            'oldest_wait': now - oldest,
+                            'mean_wait': agent.waited / agent.taken if agent.taken else None } );
+
+        return stats
